@@ -0,0 +1,148 @@
+import argparse
+import os
+import subprocess
+
+from ._consts import INTELLIJ_REF, AOSP_URL
+from ._git import (
+    git_log,
+    git_parse_rev,
+    git_try_read_aosp_commit,
+    git_worktree_checkout,
+    git_cache_dir,
+)
+from ._onto import WORKTREE_DIR
+from ._test import TEST_CASES, run_cases
+from ._trace import traced
+from ._util import log, log_error
+
+# branch names cannot start with a dot, this never clashes with the worktrees
+# of `aosp pick --onto`
+WORKTREE_NAME = '.bisect'
+
+
+def picked_commits(repo: str, revisions: str) -> list[tuple[str, str]]:
+    """
+    Lists the picked commits in the range, oldest first, as pairs of the
+    commit and the aosp commit from its `AOSP: ...` line. Commits without the
+    line are skipped.
+    """
+
+    output = subprocess.check_output(
+        ['git', 'rev-list', '--reverse', '--first-parent', revisions],
+        cwd=repo,
+    )
+
+    commits = []
+    for commit in output.decode().split():
+        aosp_commit = git_try_read_aosp_commit(repo, commit)
+
+        if aosp_commit is not None:
+            commits.append((commit, aosp_commit))
+
+    return commits
+
+
+@traced
+def bisect(commits: list[str], passes: callable) -> int | None:
+    """
+    Finds the index of the first commit for which the predicate fails, under
+    the assumption that the parent of the first commit passes and that all
+    commits after a failing commit fail as well. Returns None if the last
+    commit passes. Evaluates the predicate O(log n) times.
+    """
+
+    if len(commits) == 0 or passes(commits[-1]):
+        return None
+
+    good, bad = -1, len(commits) - 1
+
+    while bad - good > 1:
+        middle = (good + bad) // 2
+
+        if passes(commits[middle]):
+            good = middle
+        else:
+            bad = middle
+
+    return bad
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        'range',
+        type=str,
+        nargs='?',
+        help='range of picked commits, defaults to %s..HEAD' % INTELLIJ_REF,
+        default='%s..HEAD' % INTELLIJ_REF,
+    )
+    parser.add_argument(
+        '--target',
+        type=str,
+        nargs='+',
+        choices=[case.target for case in TEST_CASES],
+        help='test cases used as predicate, defaults to all',
+    )
+    parser.add_argument(
+        '--nocache',
+        action='store_true',
+        help='ignore cached results from previous runs',
+        default=False,
+    )
+    parser.add_argument(
+        '--remote_cache',
+        type=str,
+        help='url of a bazel remote cache, replaces the local disk cache '
+             '(env: AOSP_REMOTE_CACHE)',
+        default=os.environ.get('AOSP_REMOTE_CACHE'),
+    )
+
+
+@traced
+def execute(args: argparse.Namespace):
+    repo = args.repo
+
+    commits = picked_commits(repo, args.range)
+    if len(commits) == 0:
+        log_error('no picked commits in %s' % args.range)
+
+    log('bisecting %d picked commits' % len(commits))
+
+    # the full case targets are tested, the affected targets of a single
+    # commit would miss breakages caused by earlier commits
+    runs = [
+        ('test', case, [case.target]) for case in TEST_CASES
+        if args.target is None or case.target in args.target
+    ]
+
+    # the commits are tested in a separate worktree, the checkout and the
+    # bazel state of the repository stay untouched
+    path = os.path.join(git_cache_dir(repo), WORKTREE_DIR, WORKTREE_NAME)
+    steps = 0
+
+    def passes(commit: str) -> bool:
+        nonlocal steps
+        steps += 1
+
+        log('testing %s' % git_log(repo, commit, '%h %s'))
+        git_worktree_checkout(repo, path, commit)
+
+        return run_cases(path, runs, not args.nocache, args.remote_cache)
+
+    # the bisection assumes a passing base, a failing base would blame the
+    # first picked commit for a breakage it did not cause
+    base = git_parse_rev(repo, '%s~1' % commits[0][0])
+    if not passes(base):
+        log_error('base already fails: %s' % git_log(repo, base, '%h %s'))
+
+    index = bisect([commit for commit, _ in commits], passes)
+
+    if index is None:
+        log('all picked commits pass (%d steps)' % steps)
+        return
+
+    commit, aosp_commit = commits[index]
+
+    log('first bad commit after %d steps: %s' % (
+        steps, git_log(repo, commit, '%h %s')
+    ))
+    log('aosp commit: %s%s' % (AOSP_URL, aosp_commit))
@@ -0,0 +1,207 @@
+import argparse
+import collections
+import hashlib
+import http.server
+import os
+import re
+import threading
+
+from ._util import log
+
+DEFAULT_DIR = '~/.cache/aosp/bazel'
+DEFAULT_PORT = 9092
+DEFAULT_SIZE = 20
+
+# paths of the bazel http cache protocol, an optional instance name can
+# prefix the path
+PATH_PATTERN = re.compile(r'^/(?:.+/)?(ac|cas)/([0-9a-f]{64})$')
+
+
+class Store:
+    """
+    File based blob store for the action cache and the content addressable
+    storage. Evicts the least recently used blobs once the total size exceeds
+    the limit.
+    """
+
+    def __init__(self, dir: str, max_size: int):
+        self.dir = dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        for kind in ['ac', 'cas']:
+            os.makedirs(os.path.join(dir, kind), exist_ok=True)
+
+        self.load()
+
+    def path(self, kind: str, hash: str) -> str:
+        return os.path.join(self.dir, kind, hash)
+
+    def load(self):
+        """
+        Restores the lru order from the modification time of the blobs.
+        """
+
+        blobs = []
+        for kind in ['ac', 'cas']:
+            for entry in os.scandir(os.path.join(self.dir, kind)):
+                # left over from an interrupted write
+                if entry.name.endswith('.tmp'):
+                    os.remove(entry.path)
+                    continue
+
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, (kind, entry.name), stat.st_size))
+
+        for _, key, size in sorted(blobs):
+            self.entries[key] = size
+            self.size += size
+
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_size and len(self.entries) > 0:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+
+            try:
+                os.remove(self.path(*key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, kind: str, hash: str) -> bytes | None:
+        with self.lock:
+            if (kind, hash) not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end((kind, hash))
+
+        path = self.path(kind, hash)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def put(self, kind: str, hash: str, data: bytes):
+        path = self.path(kind, hash)
+
+        # write to a temporary file first to never serve partial blobs
+        tmp = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self.lock:
+            self.size -= self.entries.pop((kind, hash), 0)
+            self.entries[(kind, hash)] = len(data)
+            self.size += len(data)
+            self.evict()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    store: Store = None
+
+    def parse(self) -> tuple[str, str] | None:
+        match = PATH_PATTERN.match(self.path)
+
+        if match is None:
+            self.reply(404)
+            return None
+
+        return match.group(1), match.group(2)
+
+    def reply(self, code: int, data: bytes = b''):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        key = self.parse()
+        if key is None:
+            return
+
+        data = self.store.get(*key)
+
+        if data is None:
+            self.reply(404)
+        else:
+            self.reply(200, data)
+
+    def do_PUT(self):
+        key = self.parse()
+        if key is None:
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+
+        kind, hash = key
+
+        # blobs in the cas are addressed by their content
+        if kind == 'cas' and hashlib.sha256(data).hexdigest() != hash:
+            self.reply(400)
+            return
+
+        self.store.put(kind, hash, data)
+        self.reply(200)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--dir',
+        type=str,
+        help='directory to store the cache in',
+        default=DEFAULT_DIR,
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        help='port to listen on',
+        default=DEFAULT_PORT,
+    )
+    parser.add_argument(
+        '--host',
+        type=str,
+        help='address to listen on',
+        default='127.0.0.1',
+    )
+    parser.add_argument(
+        '--size',
+        type=int,
+        help='maximum size of the cache in GiB',
+        default=DEFAULT_SIZE,
+    )
+
+
+def execute(args: argparse.Namespace):
+    dir = os.path.expanduser(args.dir)
+    Handler.store = Store(dir, args.size * 1024 ** 3)
+
+    server = http.server.ThreadingHTTPServer((args.host, args.port), Handler)
+    log('serving %s on http://%s:%d' % (dir, args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store = Handler.store
+        log('%d hits, %d misses, %.1f MiB stored' % (
+            store.hits, store.misses, store.size / 1024 ** 2
+        ))
@@ -1,5 +1,6 @@
 import os
 import argparse
+import time
 
 from ._util import log
 
@@ -95,17 +96,115 @@ REPLACEMENTS = {
 }
 
 
+# per rule statistics if profiling is enabled, maps the source of the rule to
+# the number of processed texts with a match, the number of matches and the
+# time spent in nanoseconds
+PROFILE = None
+
+
 def process(text: str) -> str:
     """
     Processes one text line. Applies all defined replacements.
     """
 
+    if PROFILE is not None:
+        return process_profiled(text)
+
     for src, dst in REPLACEMENTS.items():
         text = text.replace(src, dst)
 
     return text
 
 
+def process_profiled(text: str) -> str:
+    """
+    Same as process but records the statistics for every rule. Only the time
+    of the replacement itself is recorded, not the time of the bookkeeping.
+    """
+
+    for src, dst in REPLACEMENTS.items():
+        start = time.perf_counter_ns()
+        result = text.replace(src, dst)
+        elapsed = time.perf_counter_ns() - start
+
+        stats = PROFILE[src]
+        stats[2] += elapsed
+
+        if src in text:
+            stats[0] += 1
+            stats[1] += text.count(src)
+
+        text = result
+
+    return text
+
+
+def profile_enable():
+    global PROFILE
+    PROFILE = {src: [0, 0, 0] for src in REPLACEMENTS}
+
+
+def shadowed_rules() -> dict[str, str]:
+    """
+    Finds rules that can never match because earlier rules rewrite their
+    source first. The earlier rules are applied to the source of every rule
+    in order, the rule is shadowed if its source is gone afterwards. Maps the
+    shadowed rule to the earlier rule that removed the source.
+    """
+
+    rules = list(REPLACEMENTS.items())
+    shadowed = {}
+
+    for i, (src, _) in enumerate(rules):
+        text = src
+
+        for earlier, dst in rules[:i]:
+            text = text.replace(earlier, dst)
+
+            if src not in text:
+                shadowed[src] = earlier
+                break
+
+    return shadowed
+
+
+def profile_report(top: int = 10):
+    """
+    Prints the hottest, dead, shadowed and no-op rules of the profile.
+    """
+
+    if PROFILE is None:
+        return
+
+    total = sum(it[2] for it in PROFILE.values())
+
+    log('rule profile, %.1fms in %d rules' % (total / 1e6, len(PROFILE)))
+
+    # ranked by hits, the time of a single replace is mostly noise
+    print('hottest rules:')
+    for src, (hits, matches, elapsed) in sorted(
+        PROFILE.items(), key=lambda it: (it[1][0], it[1][2]), reverse=True
+    )[:top]:
+        print('  %7.2fms %6d hits %6d matches  %s' % (
+            elapsed / 1e6, hits, matches, src
+        ))
+
+    dead = [src for src, stats in PROFILE.items() if stats[0] == 0]
+    print('dead rules (%d):' % len(dead))
+    for src in dead:
+        print('  %s' % src)
+
+    shadowed = shadowed_rules()
+    print('shadowed rules (%d):' % len(shadowed))
+    for src, earlier in shadowed.items():
+        print('  %s by %s' % (src, earlier))
+
+    noop = [src for src, dst in REPLACEMENTS.items() if src == dst]
+    print('no-op rules (%d):' % len(noop))
+    for src in noop:
+        print('  %s' % src)
+
+
 def walk(path):
     """
     Walks a directory and processes every file in the directory.
@@ -1,6 +1,9 @@
 import subprocess
+import fnmatch
+import functools
 import sys
 import os
+import tempfile
 
 from ._consts import (
     AOSP_REMOTE,
@@ -11,7 +14,19 @@ from ._consts import (
     INTELLIJ_BRANCH,
 )
 
-from ._util import log, log_error
+from ._trace import traced
+from ._util import log, log_error, first
+
+
+def git_odb(repo: str):
+    """
+    Gets the in-process object reader if it is enabled. It can only be enabled
+    after its module was imported, the module is not imported here to keep
+    the startup fast.
+    """
+
+    odb = sys.modules.get(__package__ + '._odb')
+    return None if odb is None else odb.odb_get(repo)
 
 
 def git_add_remote(repo: str, origin: str, remote: str):
@@ -21,8 +36,10 @@ def git_add_remote(repo: str, origin: str, remote: str):
     """
 
     try:
+        # read the configured url, get-url would apply url.*.insteadOf rewrites
+        # and mirrors of the remote would be rejected
         output = subprocess.check_output(
-            ['git', 'remote', 'get-url', origin],
+            ['git', 'config', '--get', 'remote.%s.url' % origin],
             cwd=repo,
         )
 
@@ -44,6 +61,7 @@ def git_add_remote(repo: str, origin: str, remote: str):
         log('added %s remote' % origin)
 
 
+@traced
 def git_fetch_remote(repo: str, origin: str, branch: str):
     """
     Fetches a branch from the origin.
@@ -58,6 +76,22 @@ def git_fetch_remote(repo: str, origin: str, branch: str):
     log('%s up to date' % origin)
 
 
+@traced
+def git_fetch_branches(repo: str, origin: str, branches: list[str]):
+    """
+    Fetches multiple branches from the origin with a single fetch.
+    """
+
+    subprocess.check_call(
+        ['git', 'fetch', origin, *branches],
+        cwd=repo,
+        stderr=sys.stdout,
+        stdout=sys.stdout,
+    )
+    log('%s up to date' % origin)
+
+
+@traced
 def git_setup_aosp(repo: str):
     """
     Adds the aosp remote to the repository and fetches the main branch.
@@ -67,6 +101,7 @@ def git_setup_aosp(repo: str):
     git_fetch_remote(repo, AOSP_ORIGIN, AOSP_BRANCH)
 
 
+@traced
 def git_setup_intellij(repo: str):
     """
     Adds the intelli remote to the repository and fetches the main branch.
@@ -76,6 +111,7 @@ def git_setup_intellij(repo: str):
     git_fetch_remote(repo, INTELLIJ_ORIGIN, INTELLIJ_BRANCH)
 
 
+@traced
 def git_log(repo: str, commit: str, format: str) -> str:
     """
     Runs git log for the specified commit and uses the format specifier.
@@ -87,6 +123,13 @@ def git_log(repo: str, commit: str, format: str) -> str:
         %H   Commit hash
     """
 
+    odb = git_odb(repo)
+    if odb is not None:
+        output = odb.log(commit, format)
+
+        if output is not None:
+            return output
+
     output = subprocess.check_output(
         ['git', 'log', '--pretty=format:' + format, '-n 1', commit],
         cwd=repo,
@@ -138,11 +181,19 @@ def git_read_aosp_commit(repo: str, commit: str) -> str:
     return aosp_commit
 
 
+@traced
 def git_branch_contains(repo: str, origin: str, branch: str, commit: str) -> bool:
     """
     Checks if a branch contains the specific commit.
     """
 
+    odb = git_odb(repo)
+    if odb is not None:
+        contains = odb.is_ancestor(commit, '%s/%s' % (origin, branch))
+
+        if contains is not None:
+            return contains
+
     result = subprocess.run(
         [
             'git',
@@ -160,17 +211,21 @@ def git_branch_contains(repo: str, origin: str, branch: str, commit: str) -> boo
     return result.returncode == 0
 
 
+@traced
 def git_list_files(repo: str, commit: str) -> list[str]:
     """
     Gets all files modified by this commit.
     """
 
-    output = subprocess.check_output(
-        ['git', 'diff-tree', '--no-commit-id', '--name-only', commit, '-r'],
-        cwd=repo,
-    )
+    odb = git_odb(repo)
+    files = None if odb is None else odb.list_files(commit)
 
-    files = output.decode().splitlines()
+    if files is None:
+        output = subprocess.check_output(
+            ['git', 'diff-tree', '--no-commit-id', '--name-only', commit, '-r'],
+            cwd=repo,
+        )
+        files = output.decode().splitlines()
 
     # if the commit from the aosp brnach, the file paths need to be remapped
     if not git_branch_contains(repo, AOSP_ORIGIN, AOSP_BRANCH, commit):
@@ -184,7 +239,268 @@ def git_parse_rev(repo: str, rev: str) -> str:
     Gets the hash of a revision like HEAD.
     """
 
+    odb = git_odb(repo)
+    if odb is not None:
+        sha = odb.resolve(rev, peel=False)
+
+        if sha is not None:
+            return sha
+
     return subprocess.check_output(
         ['git', 'rev-parse', rev],
         cwd=repo,
     ).decode().strip()
+
+
+@traced
+def git_has_changes(repo: str) -> bool:
+    """
+    Returns true if there are uncommitted changes.
+    """
+
+    output = subprocess.check_output(
+        ['git', 'status', '-s'],
+        cwd=repo,
+    )
+
+    for line in output.decode().splitlines():
+        # ignore the always changing lock file
+        if 'MODULE.bazel.lock' in line:
+            continue
+
+        return True
+
+    return False
+
+
+@functools.cache
+def git_cache_dir(repo: str) -> str:
+    """
+    Gets the directory used by the tool to store cached data for this
+    repository. The directory lives inside the common git directory and is
+    therefore shared between all worktrees. The result is cached for the
+    lifetime of the process.
+    """
+
+    common = subprocess.check_output(
+        ['git', 'rev-parse', '--git-common-dir'],
+        cwd=repo,
+    ).decode().strip()
+
+    return os.path.join(repo, common, 'aosp')
+
+
+@traced
+def git_list_tree(repo: str, commit: str) -> list[str]:
+    """
+    Gets the paths of all files in the tree of the commit.
+    """
+
+    output = subprocess.check_output(
+        ['git', 'ls-tree', '-r', '-z', '--name-only', '--full-tree', commit],
+        cwd=repo,
+    )
+
+    return [it.decode() for it in output.split(b'\0') if it]
+
+
+@traced
+def git_hash_files(repo: str, commit: str, patterns: list[str]) -> str:
+    """
+    Computes a hash over all files in the tree of the commit whose basename
+    matches one of the glob patterns. The hash changes iff one of these files
+    changes.
+    """
+
+    output = subprocess.check_output(
+        ['git', 'ls-tree', '-r', '-z', '--full-tree', commit],
+        cwd=repo,
+    )
+
+    # imported lazily, hashlib is slow to import
+    import hashlib
+
+    sha = hashlib.sha1()
+    for line in output.split(b'\0'):
+        if not line:
+            continue
+
+        path = line.split(b'\t', 1)[1]
+        name = os.path.basename(path).decode()
+
+        if any(fnmatch.fnmatch(name, it) for it in patterns):
+            sha.update(line)
+            sha.update(b'\n')
+
+    return sha.hexdigest()
+
+
+@traced
+def git_merge_tree(repo: str, base: str, ours: str, theirs: str) -> str | None:
+    """
+    Merges two commits in the object database without touching the index or
+    the working tree. Returns the merged tree or None if there are conflicts.
+
+    Uses `git merge-tree --write-tree` if git supports an explicit merge base
+    and otherwise falls back to a trivial merge in a temporary index.
+    """
+
+    result = subprocess.run(
+        [
+            'git',
+            'merge-tree',
+            '--write-tree',
+            '--no-messages',
+            '--merge-base=%s' % base,
+            ours,
+            theirs,
+        ],
+        cwd=repo,
+        capture_output=True,
+    )
+
+    if result.returncode == 0:
+        return result.stdout.decode().split()[0]
+    if result.returncode == 1:
+        return None
+
+    with tempfile.TemporaryDirectory() as dir:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(dir, 'index'))
+
+        result = subprocess.run(
+            ['git', 'read-tree', '-i', '-m', '--aggressive', base, ours,
+             theirs],
+            cwd=repo,
+            env=env,
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            return None
+
+        # fails if the index still contains unmerged entries
+        result = subprocess.run(
+            ['git', 'write-tree'],
+            cwd=repo,
+            env=env,
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            return None
+
+        return result.stdout.decode().strip()
+
+
+@traced
+def git_commit_tree(repo: str, tree: str, parent: str, original: str) -> str:
+    """
+    Creates a commit for the tree on top of the parent. Author and message are
+    copied from the original commit, like a cherry-pick does.
+    """
+
+    # the raw message, headers are separated by the first empty line
+    message = subprocess.check_output(
+        ['git', 'cat-file', 'commit', original],
+        cwd=repo,
+    ).split(b'\n\n', 1)[1]
+    author = git_log(repo, original, '%an%n%ae%n%aI').splitlines()
+
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME=author[0],
+        GIT_AUTHOR_EMAIL=author[1],
+        GIT_AUTHOR_DATE=author[2],
+    )
+
+    return subprocess.check_output(
+        ['git', 'commit-tree', tree, '-p', parent, '-F', '-'],
+        cwd=repo,
+        env=env,
+        input=message,
+    ).decode().strip()
+
+
+@traced
+def git_update_ref(repo: str, ref: str, commit: str):
+    """
+    Points the ref to the commit, creates the ref if it does not exist.
+    """
+
+    subprocess.check_call(
+        ['git', 'update-ref', ref, commit],
+        cwd=repo,
+        stderr=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+@traced
+def git_worktree_checkout(repo: str, path: str, commit: str):
+    """
+    Checks out the commit in a detached worktree at the path. The worktree is
+    created if it does not exist and reused otherwise.
+    """
+
+    if os.path.exists(path):
+        command = ['git', 'checkout', '--detach', '-f', commit]
+        cwd = path
+    else:
+        command = ['git', 'worktree', 'add', '-f', '--detach', path, commit]
+        cwd = repo
+
+    subprocess.check_call(
+        command,
+        cwd=cwd,
+        stderr=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+@traced
+def git_branch_exists(repo: str, branch: str) -> bool:
+    result = subprocess.run(
+        ['git', 'rev-parse', '--quiet', '--verify', 'refs/heads/%s' % branch],
+        cwd=repo,
+        stdout=subprocess.DEVNULL,
+    )
+
+    return result.returncode == 0
+
+
+def git_push_branches(repo: str, remote: str, branches: list[str],
+                      atomic: bool) -> dict[str, str | None]:
+    """
+    Force pushes all branches in a single `git push` and sets their upstream.
+    Returns for every branch None if the push succeeded or the reason why the
+    ref was rejected. If atomic is true either all refs are updated or none.
+    """
+
+    refspecs = ['+refs/heads/%s:refs/heads/%s' % (it, it) for it in branches]
+
+    result = subprocess.run(
+        ['git', 'push', '--porcelain', '--set-upstream', remote, *refspecs]
+        + (['--atomic'] if atomic else []),
+        cwd=repo,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    # default for refs git did not report on, e.g. if the remote is unreachable
+    error = first(
+        line for line in result.stderr.decode().splitlines()
+        if line.startswith('fatal: ') or line.startswith('error: ')
+    )
+    results = {it: error or 'push failed' for it in branches}
+
+    # porcelain lines have the format: <flag> \t <from>:<to> \t <summary>
+    for line in result.stdout.decode().splitlines():
+        parts = line.split('\t')
+        if len(parts) != 3:
+            continue
+
+        flag, refs, summary = parts
+        branch = refs.split(':', 1)[1].removeprefix('refs/heads/')
+
+        if branch in results:
+            results[branch] = summary if flag == '!' else None
+
+    return results
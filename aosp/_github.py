@@ -0,0 +1,284 @@
+import contextlib
+import json
+import os
+import queue
+import re
+import subprocess
+import time
+import urllib.parse
+
+from ._trace import traced
+from ._util import log
+
+GITHUB_API = 'https://api.github.com'
+GITHUB_REPO = 'bazelbuild/intellij'
+REVIEWERS = ['LeFrosch']
+
+# number of kept-alive connections, also the number of concurrent requests
+POOL_SIZE = 4
+
+# retries for rate limited requests and dropped connections
+MAX_RETRIES = 5
+
+# initial backoff for rate limited requests without a reset time and for
+# server errors in seconds
+BACKOFF = 1.0
+
+# methods that can be retried after a dropped connection, a POST might have
+# been processed and would for example create a PR twice
+IDEMPOTENT = ['GET', 'HEAD', 'PUT', 'DELETE']
+
+# server errors after which the request was not processed and can be retried
+RETRIED_STATUS = [502, 503, 504]
+
+# never wait longer than this for a rate limit reset in seconds
+MAX_WAIT = 15 * 60
+
+USER_AGENT = 'aosp-pick'
+
+
+class GitHubError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__('github request failed (%d): %s' % (status, message))
+        self.status = status
+
+
+def github_token() -> str | None:
+    """
+    Gets the token from the environment or from the github cli.
+    """
+
+    for name in ['GITHUB_TOKEN', 'GH_TOKEN']:
+        if os.environ.get(name):
+            return os.environ[name]
+
+    try:
+        result = subprocess.run(
+            ['gh', 'auth', 'token'],
+            capture_output=True,
+        )
+    except OSError:
+        return None
+
+    if result.returncode != 0:
+        return None
+
+    return result.stdout.decode().strip()
+
+
+def rate_limit_wait(status: int, headers, attempt: int) -> float | None:
+    """
+    Computes how long to wait before retrying a rate limited request. Returns
+    None if the response is not rate limited.
+    """
+
+    if status not in [403, 429]:
+        return None
+
+    retry_after = headers.get('retry-after')
+    if retry_after is not None:
+        return float(retry_after)
+
+    if headers.get('x-ratelimit-remaining') == '0':
+        reset = float(headers.get('x-ratelimit-reset', time.time()))
+        return max(reset - time.time(), 0) + 1
+
+    # secondary rate limits do not always send headers
+    if status == 429:
+        return BACKOFF * 2 ** attempt
+
+    return None
+
+
+class GitHub:
+    """
+    Minimal client for the github REST API. Requests are sent over a pool of
+    kept-alive connections, which makes it safe to use from multiple threads.
+    """
+
+    def __init__(self, base_url: str, token: str | None,
+                 size: int = POOL_SIZE):
+        url = urllib.parse.urlsplit(base_url)
+
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.token = token
+        self.size = size
+        self.pool = queue.LifoQueue()
+
+        for _ in range(size):
+            self.pool.put(None)
+
+    def connect(self):
+        # imported lazily, commands like missing only use the cached data
+        import http.client
+
+        if self.scheme == 'http':
+            return http.client.HTTPConnection(self.host, timeout=60)
+
+        return http.client.HTTPSConnection(self.host, timeout=60)
+
+    @contextlib.contextmanager
+    def connection(self):
+        # connections are created lazily, the pool limits their number
+        connection = self.pool.get() or self.connect()
+
+        try:
+            yield connection
+        except BaseException:
+            connection.close()
+            connection = None
+            raise
+        finally:
+            self.pool.put(connection)
+
+    def request(self, method: str, path: str, body=None) -> dict:
+        _, _, result = self.send(method, path, body)
+        return result
+
+    def send(self, method: str, path: str, body=None,
+             extra: dict | None = None) -> (int, dict, dict | list | None):
+        """
+        Sends a request and returns the status, the response headers and the
+        decoded content. Raises a GitHubError for all errors, a 304 response
+        is returned with None as content.
+        """
+
+        headers = {
+            'Accept': 'application/vnd.github+json',
+            'User-Agent': USER_AGENT,
+            'X-GitHub-Api-Version': '2022-11-28',
+            **(extra or {}),
+        }
+        if self.token is not None:
+            headers['Authorization'] = 'Bearer %s' % self.token
+
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        from http.client import HTTPException
+
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with self.connection() as connection:
+                    connection.request(
+                        method,
+                        self.prefix + path,
+                        body=data,
+                        headers=headers,
+                    )
+                    response = connection.getresponse()
+                    content = response.read()
+
+            # kept-alive connections might have been closed by the server
+            except (HTTPException, ConnectionError) as e:
+                if attempt < MAX_RETRIES and method in IDEMPOTENT:
+                    continue
+
+                raise GitHubError(0, 'connection failed: %r' % e) from e
+
+            wait = rate_limit_wait(response.status, response.headers, attempt)
+            if wait is not None and attempt < MAX_RETRIES and wait < MAX_WAIT:
+                log('github rate limit, waiting %.0fs' % wait)
+                time.sleep(wait)
+                continue
+
+            if response.status in RETRIED_STATUS and attempt < MAX_RETRIES:
+                time.sleep(BACKOFF * 2 ** attempt)
+                continue
+
+            if response.status == 304:
+                return response.status, response.headers, None
+
+            # error pages of proxies are not json, e.g. for a 502
+            try:
+                result = json.loads(content) if content else {}
+            except ValueError:
+                raise GitHubError(
+                    response.status,
+                    content.decode(errors='replace').strip()[:200],
+                )
+
+            if response.status >= 400:
+                message = result.get('message', response.reason)
+                raise GitHubError(response.status, message)
+
+            return response.status, response.headers, result
+
+    @traced
+    def create_pr(self, repo: str, head: str, base: str, title: str,
+                  body: str, draft: bool) -> dict:
+        return self.request('POST', '/repos/%s/pulls' % repo, {
+            'head': head,
+            'base': base,
+            'title': title,
+            'body': body,
+            'draft': draft,
+        })
+
+    @traced
+    def request_reviewers(self, repo: str, number: int, reviewers: list[str]):
+        self.request(
+            'POST',
+            '/repos/%s/pulls/%d/requested_reviewers' % (repo, number),
+            {'reviewers': reviewers},
+        )
+
+    def submit_pr(self, repo: str, request: dict) -> dict:
+        """
+        Creates the PR and requests the reviewers. The request contains the
+        arguments of create_pr and the reviewers. A failed review request is
+        only logged, the PR exists at this point and must be returned.
+        """
+
+        request = dict(request)
+        reviewers = request.pop('reviewers', [])
+
+        pr = self.create_pr(repo, **request)
+
+        if len(reviewers) > 0:
+            try:
+                self.request_reviewers(repo, pr['number'], reviewers)
+            except (GitHubError, OSError) as e:
+                log('could not request reviewers for %s: %s' % (
+                    pr['html_url'], e
+                ))
+
+        return pr
+
+    def submit_prs(self, repo: str, requests: list[dict]) -> list:
+        """
+        Submits multiple PRs concurrently over the connection pool. Returns the
+        created PR or the exception for every request.
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(self.size) as executor:
+            futures = [
+                executor.submit(self.submit_pr, repo, it) for it in requests
+            ]
+
+        return [it.exception() or it.result() for it in futures]
+
+
+def github_client() -> GitHub:
+    """
+    Creates a client for the API at AOSP_GITHUB_API or api.github.com. The
+    base url can point to a local stand-in server.
+    """
+
+    base_url = os.environ.get('AOSP_GITHUB_API', GITHUB_API)
+    return GitHub(base_url, github_token())
+
+
+def github_owner(url: str) -> str | None:
+    """
+    Extracts the owner from a github remote url.
+    """
+
+    match = re.search(r'github\.com[:/]([^/]+)/', url)
+    return match.group(1) if match else None
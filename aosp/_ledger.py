@@ -0,0 +1,187 @@
+import contextlib
+import os
+import subprocess
+import time
+
+from ._git import git_cache_dir
+from ._util import log
+
+LEDGER_FILE = 'ledger.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL,
+    aosp_commit TEXT,
+    outcome TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    conflicts INTEGER NOT NULL,
+    rerere INTEGER NOT NULL,
+    manual INTEGER NOT NULL,
+    drift INTEGER
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cases (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    command TEXT NOT NULL,
+    target TEXT NOT NULL,
+    commit_hash TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    passed INTEGER NOT NULL,
+    cached INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+'''
+
+# the record of the current run, None if the run is not recorded
+RUN: dict | None = None
+
+
+def ledger_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), LEDGER_FILE)
+
+
+def ledger_connect(repo: str):
+    # imported lazily, only needed when a run is written or reported
+    import sqlite3
+
+    os.makedirs(git_cache_dir(repo), exist_ok=True)
+
+    connection = sqlite3.connect(ledger_path(repo))
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+def ledger_set(**fields):
+    """
+    Sets fields of the current run, e.g. the aosp commit or the outcome.
+    """
+
+    if RUN is not None:
+        RUN.update(fields)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """
+    Records the duration of the body as a stage of the current run.
+    """
+
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if RUN is not None:
+            RUN['stages'].append((name, time.monotonic() - start))
+
+
+def ledger_case(command: str, target: str, commit: str, passed: bool,
+                cached: bool, duration: float):
+    """
+    Records a bazel invocation of the current run. Invocations of the same
+    target on the same commit are numbered, the first one is the first try.
+    """
+
+    if RUN is None:
+        return
+
+    attempt = 1 + sum(
+        1 for it in RUN['cases']
+        if it[0] == command and it[1] == target and it[2] == commit
+    )
+
+    RUN['cases'].append(
+        (command, target, commit, attempt, passed, cached, duration)
+    )
+
+
+def ledger_write(repo: str, run: dict):
+    connection = ledger_connect(repo)
+
+    try:
+        with connection:
+            cursor = connection.execute(
+                'INSERT INTO runs (command, aosp_commit, outcome, started, '
+                'duration, conflicts, rerere, manual, drift) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    run['command'],
+                    run['aosp_commit'],
+                    run['outcome'],
+                    run['started'],
+                    run['duration'],
+                    run['conflicts'],
+                    run['rerere'],
+                    run['manual'],
+                    run['drift'],
+                ),
+            )
+
+            connection.executemany(
+                'INSERT INTO stages VALUES (?, ?, ?)',
+                [(cursor.lastrowid, *it) for it in run['stages']],
+            )
+            connection.executemany(
+                'INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(cursor.lastrowid, *it) for it in run['cases']],
+            )
+
+    finally:
+        connection.close()
+
+
+@contextlib.contextmanager
+def ledger_run(repo: str, command: str):
+    """
+    Records the command run in the body to the ledger. The outcome is derived
+    from how the body exits, unless the command set it explicitly.
+    """
+
+    # imported lazily, only needed for the error handling of the write
+    import sqlite3
+
+    global RUN
+    RUN = {
+        'command': command,
+        'aosp_commit': None,
+        'outcome': None,
+        'started': time.time(),
+        'conflicts': 0,
+        'rerere': False,
+        'manual': False,
+        'drift': None,
+        'stages': [],
+        'cases': [],
+    }
+
+    start = time.monotonic()
+    outcome = 'error'
+
+    try:
+        yield
+        outcome = 'ok'
+    except SystemExit as e:
+        outcome = 'ok' if e.code in [0, None] else 'failed'
+        raise
+    except KeyboardInterrupt:
+        outcome = 'interrupted'
+        raise
+    finally:
+        run, RUN = RUN, None
+        run['duration'] = time.monotonic() - start
+
+        if run['outcome'] is None:
+            run['outcome'] = outcome
+
+        # the ledger must never fail the command
+        try:
+            ledger_write(repo, run)
+        except (sqlite3.Error, OSError, subprocess.CalledProcessError) as e:
+            log('could not write the run ledger: %s' % e)
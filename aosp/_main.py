@@ -1,18 +1,49 @@
 import argparse
+import atexit
+import importlib
 import os
+import sys
 
-from . import (
-    _patch as patch,
-    _deaosp as deaosp,
-    _missing as missing,
-    _review as review,
-    _test as test,
-    _pick as pick,
-    _reset as reset,
-)
-
+from ._deaosp import profile_enable, profile_report
+from ._trace import trace_enable
 from .__about__ import __version__, __description__
 
+# registry of all subcommands, maps the name to the implementing module and
+# the help text. Modules are only imported when their command is chosen, to
+# keep the startup time low.
+COMMANDS = {
+    'patch': ('_patch', 'create a patch from an aosp commit'),
+    'remap': ('_deaosp', 'remap aosp specific references'),
+    'missing': ('_missing', 'collect missing commits'),
+    'review': ('_review', 'review an already applied commit'),
+    'test': ('_test', 'runs a suite of tests against the current branch'),
+    'pick': ('_pick', 'utility for picking a single commit'),
+    'push': ('_push', 'push all queued PR branches at once'),
+    'bisect': ('_bisect', 'find the first picked commit that breaks the '
+               'tests'),
+    'serve': ('_serve', 'runs a daemon that keeps the tool warm for the '
+              'repository'),
+    'watch': ('_watch', 'precompute patches for new aosp commits'),
+    'reset': ('_reset', 'utility to reset the target repository'),
+    'resolutions': ('_rerere', 'share the recorded conflict resolutions'),
+    'rules': ('_rules', 'profile the remap rules against aosp commits'),
+    'results': ('_results', 'inspect or purge the cached test results'),
+    'stats': ('_stats', 'report the pick throughput from the run ledger'),
+    'maintain': ('_maintain', 'tunes the repository for the access patterns of '
+                 'the tool'),
+    'cache-server': ('_cache_server', 'runs a local http remote cache for '
+                     'bazel'),
+}
+
+# commands that are not recorded in the run ledger, see `aosp stats`. These
+# either report on the ledger or run for an unbounded time.
+UNRECORDED = ['stats', 'serve', 'watch', 'cache-server']
+
+# non-interactive commands that are forwarded to the daemon of the repository
+# if one is running, see `aosp serve`. Commands with a pager or prompts run in
+# process, the daemon has no terminal of the client to bind them to.
+FORWARDED = ['missing', 'remap', 'rules', 'results']
+
 
 def add_repo_argument(parser: argparse.ArgumentParser):
     repo = os.environ.get('REPO')
@@ -24,7 +55,12 @@ def add_repo_argument(parser: argparse.ArgumentParser):
         parser.add_argument('--repo', type=str, help=help, required=True)
 
 
-def parse_arguments() -> argparse.Namespace:
+def create_parser(command: str | None) -> argparse.ArgumentParser:
+    """
+    Creates the argument parser. Only the chosen command is configured, all
+    other subcommands are registered with their help text only.
+    """
+
     parser = argparse.ArgumentParser(description=__description__)
 
     parser.add_argument(
@@ -35,63 +71,95 @@ def parse_arguments() -> argparse.Namespace:
 
     add_repo_argument(parser)
 
-    commands = parser.add_subparsers(
-        required=True,
-        help='available subcommands',
+    parser.add_argument(
+        '--trace',
+        type=str,
+        help='write a chrome trace of all stages to the file',
     )
 
-    patch_parser = commands.add_parser(
-        'patch',
-        help='create a patch from an aosp commit',
+    parser.add_argument(
+        '--profile-rules',
+        action='store_true',
+        help='report per rule statistics of the remapping on exit',
+        default=False,
     )
-    patch_parser.set_defaults(execute=patch.execute)
-    patch.configure(patch_parser)
 
-    deaosp_parser = commands.add_parser(
-        'remap',
-        help='remap aosp specific references',
+    parser.add_argument(
+        '--native-git',
+        action='store_true',
+        help='read git objects in process if possible (env: AOSP_NATIVE_GIT)',
+        default=os.environ.get('AOSP_NATIVE_GIT', '') not in ['', '0'],
     )
-    deaosp_parser.set_defaults(execute=deaosp.execute)
-    deaosp.configure(deaosp_parser)
 
-    missing_parser = commands.add_parser(
-        'missing',
-        help='collect missing commits',
+    commands = parser.add_subparsers(
+        required=True,
+        dest='command',
+        help='available subcommands',
     )
-    missing_parser.set_defaults(execute=missing.execute)
-    missing.configure(missing_parser)
 
-    review_parser = commands.add_parser(
-        'review',
-        help='review an already applied commit',
-    )
-    review_parser.set_defaults(execute=review.execute)
-    review.configure(review_parser)
+    for name, (module_name, help) in COMMANDS.items():
+        if name != command:
+            commands.add_parser(name, help=help, add_help=False)
+            continue
 
-    test_parser = commands.add_parser(
-        'test',
-        help='runs a suite of tests against the current branch',
-    )
-    test_parser.set_defaults(execute=test.execute)
-    test.configure(test_parser)
+        module = importlib.import_module('.' + module_name, __package__)
 
-    pick_parser = commands.add_parser(
-        'pick',
-        help='utility for picking a single commit',
-    )
-    pick_parser.set_defaults(execute=pick.execute)
-    pick.configure(pick_parser)
+        command_parser = commands.add_parser(name, help=help)
+        command_parser.set_defaults(execute=module.execute)
+        module.configure(command_parser)
 
-    reset_parser = commands.add_parser(
-        'reset',
-        help='utility to reset the target repository',
-    )
-    reset_parser.set_defaults(execute=reset.execute)
-    reset.configure(reset_parser)
+    return parser
+
+
+def parse_arguments(argv: list[str]) -> argparse.Namespace:
+    # the first pass only determines the chosen command, the second pass
+    # parses the arguments of the command
+    args, _ = create_parser(None).parse_known_args(argv)
+
+    return create_parser(args.command).parse_args(argv)
+
+
+def run(argv: list[str]):
+    """
+    Parses the arguments and runs the command in process.
+    """
+
+    args = parse_arguments(argv)
+
+    if args.trace is not None:
+        trace_enable(args.trace)
 
-    return parser.parse_args()
+    if args.profile_rules:
+        profile_enable()
+        atexit.register(profile_report)
+
+    if args.native_git:
+        from ._odb import odb_enable
+        odb_enable()
+
+    if args.command in UNRECORDED:
+        args.execute(args)
+        return
+
+    # imported lazily, the ledger is only needed once a command runs
+    from ._ledger import ledger_run
+
+    with ledger_run(args.repo, args.command):
+        args.execute(args)
 
 
 def main():
-    args = parse_arguments()
-    args.execute(args)
+    argv = sys.argv[1:]
+    args, _ = create_parser(None).parse_known_args(argv)
+
+    # forward to the daemon of the repository if one is running, commands
+    # with local instrumentation always run in process
+    if args.command in FORWARDED and args.trace is None and \
+            not args.profile_rules:
+        from ._serve import serve_forward
+        code = serve_forward(args.repo, argv)
+
+        if code is not None:
+            sys.exit(code)
+
+    run(argv)
@@ -0,0 +1,135 @@
+import argparse
+import subprocess
+import sys
+import time
+
+from ._consts import AOSP_REF, INTELLIJ_REF
+from ._util import log
+
+# the commands the tool runs most often against large repositories, timed
+# before and after the maintenance
+BENCHMARKS = [
+    ('log -- aswb', ['git', 'log', '--format=%H', AOSP_REF, '--', 'aswb']),
+    ('status -s', ['git', 'status', '-s']),
+    ('merge-base --is-ancestor', [
+        'git', 'merge-base', '--is-ancestor', INTELLIJ_REF, AOSP_REF,
+    ]),
+]
+
+# configuration that keeps the written structures up to date
+CONFIG = {
+    'core.commitGraph': 'true',
+    'core.multiPackIndex': 'true',
+    'core.untrackedCache': 'true',
+    'fetch.writeCommitGraph': 'true',
+}
+
+
+def git(repo: str, *args: str):
+    subprocess.check_call(
+        ['git', *args],
+        cwd=repo,
+        stderr=sys.stdout,
+        stdout=sys.stdout,
+    )
+
+
+def measure(repo: str, cmd: list[str], repeat: int) -> float:
+    """
+    Returns the minimum wall time of the command over multiple runs.
+    """
+
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            cmd,
+            cwd=repo,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        runs.append(time.perf_counter() - start)
+
+    return min(runs)
+
+
+def measure_all(repo: str, repeat: int) -> list[float]:
+    return [measure(repo, cmd, repeat) for _, cmd in BENCHMARKS]
+
+
+def has_fsmonitor() -> bool:
+    """
+    Checks if git was built with the builtin fsmonitor daemon, which is not
+    available on all platforms.
+    """
+
+    output = subprocess.check_output(['git', 'version', '--build-options'])
+    return b'fsmonitor--daemon' in output
+
+
+def maintain(repo: str, background: bool):
+    for key, value in CONFIG.items():
+        git(repo, 'config', key, value)
+
+    log('writing commit-graph with changed-path bloom filters')
+    git(repo, 'commit-graph', 'write', '--reachable', '--changed-paths')
+
+    log('writing multi-pack-index')
+    git(repo, 'multi-pack-index', 'write')
+
+    log('enabling untracked cache')
+    git(repo, 'update-index', '--untracked-cache')
+
+    if has_fsmonitor():
+        log('enabling builtin fsmonitor')
+        git(repo, 'config', 'core.fsmonitor', 'true')
+    else:
+        log('builtin fsmonitor not available, skipping')
+
+    if background:
+        log('registering background maintenance')
+        git(repo, 'maintenance', 'start')
+
+    # populates the untracked cache and the fsmonitor state
+    subprocess.run(
+        ['git', 'status', '-s'],
+        cwd=repo,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--no-background',
+        action='store_false',
+        help='do not register the repository for background maintenance',
+        dest='background',
+        default=True,
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        help='number of runs per timed command',
+        default=3,
+    )
+
+
+def execute(args: argparse.Namespace):
+    repo = args.repo
+
+    log('timing commands before maintenance')
+    before = measure_all(repo, args.repeat)
+
+    maintain(repo, args.background)
+
+    log('timing commands after maintenance')
+    after = measure_all(repo, args.repeat)
+
+    print('%-28s %10s %10s %8s' % ('command', 'before', 'after', ''))
+    for (name, _), old, new in zip(BENCHMARKS, before, after):
+        print('%-28s %9.3fs %9.3fs %7.1fx' % (
+            'git ' + name,
+            old,
+            new,
+            old / max(new, 1e-6),
+        ))
@@ -1,34 +1,63 @@
 import argparse
+import os
+import shutil
 import subprocess
 
-from ._consts import AOSP_URL, AOSP_REF
-from ._git import git_setup_aosp, git_log
-from ._util import log
+from ._consts import AOSP_URL, AOSP_REF, AOSP_ORIGIN, AOSP_BRANCH
+from ._git import (
+    git_setup_aosp,
+    git_log,
+    git_parse_rev,
+    git_branch_contains,
+    git_cache_dir,
+)
+from ._prs import INDEX_MAX_AGE, prs_index, format_pr
+from ._util import log, log_error, read_json, write_json
 
+WATERMARK_FILE = 'missing.json'
 
-def collect_missing_commits(repo: str, from_hash: str) -> list[str]:
-    output = subprocess.check_output(
+# number of columns written by format_commit, outputs written with a different
+# number of columns are rebuilt instead of appended to
+COLUMNS = 5
+
+
+def stream_missing_commits(repo: str, from_hash: str, to_hash: str):
+    """
+    Yields the commits between the two hashes that touch aswb, oldest first.
+    The output of git log is streamed instead of buffered.
+    """
+
+    process = subprocess.Popen(
         [
             'git',
             'log',
-            '%s..%s' % (from_hash, AOSP_REF),
-            '--pretty=format:"%H"',
+            '--reverse',
+            '%s..%s' % (from_hash, to_hash),
+            '--pretty=format:%H',
             '--',
             'aswb',
         ],
         cwd=repo,
+        stdout=subprocess.PIPE,
     )
 
-    return [hash.strip('"') for hash in output.decode().splitlines()]
+    for line in process.stdout:
+        yield line.decode().strip()
+
+    if process.wait() != 0:
+        log_error('git log failed')
 
 
-def format_commit(repo: str, commit: str) -> str:
-    return '=HYPERLINK("%s%s", "%s");%s;%s;0' % (
+def format_commit(repo: str, commit: str, prs: dict | None = None) -> str:
+    pr = None if prs is None else prs.get(commit)
+
+    return '=HYPERLINK("%s%s", "%s");%s;%s;0;%s' % (
         AOSP_URL,
         commit,
         commit,
         git_log(repo, commit, '%s'),
         git_log(repo, commit, '%as'),
+        '' if pr is None else format_pr(pr),
     )
 
 
@@ -47,20 +76,108 @@ def configure(parser: argparse.ArgumentParser):
         default='missing.csv',
     )
 
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help='rebuild the whole output instead of appending new commits',
+        default=False,
+    )
+
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='refresh the index of pick PRs, by default it is only refreshed '
+             'if it is older than an hour',
+        default=False,
+    )
+
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='never refresh the index of pick PRs',
+        default=False,
+    )
+
+
+def watermark_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), WATERMARK_FILE)
+
 
 def execute(args: argparse.Namespace):
     repo = args.repo
     git_setup_aosp(repo)
 
-    log('collectting commits')
-    missing = collect_missing_commits(repo, args.commit)
+    output = os.path.abspath(args.output)
+    tip = git_parse_rev(repo, AOSP_REF)
+
+    # the watermark records the aosp tip of the last run for every output
+    watermarks = read_json(watermark_path(repo), {})
+    watermark = watermarks.get(output)
+
+    append = (
+        not args.rebuild
+        and watermark is not None
+        and watermark['from'] == args.commit
+        and watermark.get('columns') == COLUMNS
+        and os.path.exists(output)
+        and git_branch_contains(repo, AOSP_ORIGIN, AOSP_BRANCH,
+                                watermark['tip'])
+    )
 
-    log('found %d missing commits' % len(missing))
-    if len(missing) == 0:
+    if append:
+        start = watermark['tip']
+        log('collecting commits since last run')
+    else:
+        start = args.commit
+        log('collecting commits')
+
+    # the pr column of existing rows is only written once, there is nothing
+    # to append and the index is therefore not refreshed
+    if append and watermark['tip'] == tip:
+        log('no new commits, --rebuild refreshes the pr states')
         return
 
-    content = '\n'.join(format_commit(repo, it) for it in reversed(missing))
+    # the pr column does not need the latest state, a recent index saves the
+    # github requests on every run
+    prs = prs_index(
+        repo,
+        refresh=args.refresh,
+        max_age=None if args.offline else INDEX_MAX_AGE,
+    )
+
+    count = 0
+    in_flight = 0
+
+    # the rows are written to a copy that replaces the output together with
+    # the watermark, an interrupted run leaves both untouched and the next
+    # run does not append the same commits twice
+    temp = output + '.tmp'
+    if append:
+        shutil.copyfile(output, temp)
+
+    with open(temp, 'at' if append else 'wt') as f:
+        # files written by earlier versions do not end with a newline
+        if append and f.tell() > 0:
+            with open(temp, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read() != b'\n':
+                    f.write('\n')
+
+        for commit in stream_missing_commits(repo, start, tip):
+            f.write(format_commit(repo, commit, prs) + '\n')
+            count += 1
+
+            if commit in prs and prs[commit]['state'] == 'open':
+                in_flight += 1
+
+    os.replace(temp, output)
+
+    watermarks[output] = {'from': args.commit, 'tip': tip, 'columns': COLUMNS}
+    write_json(watermark_path(repo), watermarks)
+
+    if in_flight > 0:
+        log('%d commits have an open pick PR' % in_flight)
 
-    log('writing commits to %s' % args.output)
-    with open(args.output, 'wt') as f:
-        f.write(content)
+    log('%s %d missing commits to %s' % (
+        'appended' if append else 'wrote', count, args.output
+    ))
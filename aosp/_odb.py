@@ -0,0 +1,940 @@
+import dataclasses
+import datetime
+import functools
+import mmap
+import os
+import struct
+import subprocess
+import zlib
+
+# object types as stored in pack files
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPES = {
+    b'commit': OBJ_COMMIT,
+    b'tree': OBJ_TREE,
+    b'blob': OBJ_BLOB,
+    b'tag': OBJ_TAG,
+}
+
+# chunk size used to inflate objects from a pack
+INFLATE_CHUNK = 64 * 1024
+
+# number of inflated objects kept in memory to resolve deltas
+CACHE_SIZE = 1024
+
+# the order in which git tries to resolve a short ref name
+REF_RULES = [
+    '%s',
+    'refs/%s',
+    'refs/tags/%s',
+    'refs/heads/%s',
+    'refs/remotes/%s',
+    'refs/remotes/%s/HEAD',
+]
+
+# commit-graph parent value for a missing parent
+GRAPH_NO_PARENT = 0x70000000
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTHS = [
+    'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+    'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec',
+]
+
+# the reader is only used if enabled
+ENABLED = False
+
+# git log formats supported by the reader
+FORMATS = ['%H', '%s', '%b', '%ad', '%as']
+
+
+def map_file(path: str) -> mmap.mmap | None:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_varint(data: bytes, i: int) -> (int, int):
+    """
+    Reads a little endian base 128 varint as used in deltas.
+    """
+
+    value = shift = 0
+
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            return value, i
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """
+    Applies a git delta to the base object.
+    """
+
+    _, i = read_varint(delta, 0)
+    size, i = read_varint(delta, i)
+
+    result = bytearray()
+
+    while i < len(delta):
+        op = delta[i]
+        i += 1
+
+        if op & 0x80:
+            offset = length = 0
+
+            for bit in range(4):
+                if op & (1 << bit):
+                    offset |= delta[i] << (bit * 8)
+                    i += 1
+            for bit in range(3):
+                if op & (0x10 << bit):
+                    length |= delta[i] << (bit * 8)
+                    i += 1
+
+            result += base[offset:offset + (length or 0x10000)]
+
+        elif op:
+            result += delta[i:i + op]
+            i += op
+
+        else:
+            raise ValueError('invalid delta opcode')
+
+    if len(result) != size:
+        raise ValueError('delta result has wrong size')
+
+    return bytes(result)
+
+
+class Pack:
+    """
+    A memory mapped pack file together with its version 2 index.
+    """
+
+    def __init__(self, path: str):
+        self.idx = map_file(path + '.idx')
+        self.pack = map_file(path + '.pack')
+
+        if self.idx is None or self.idx[:8] != b'\377tOc\0\0\0\2':
+            raise ValueError('unsupported pack index')
+
+        self.fanout = struct.unpack_from('>256I', self.idx, 8)
+        self.count = self.fanout[255]
+        self.names = 8 + 256 * 4
+        self.offsets = self.names + self.count * 24
+        self.large_offsets = self.offsets + self.count * 4
+
+    def find(self, sha: bytes) -> int | None:
+        """
+        Binary searches the index for the object and returns its offset in
+        the pack.
+        """
+
+        lo = self.fanout[sha[0] - 1] if sha[0] > 0 else 0
+        hi = self.fanout[sha[0]]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.names + mid * 20
+            name = self.idx[start:start + 20]
+
+            if name < sha:
+                lo = mid + 1
+            elif name > sha:
+                hi = mid
+            else:
+                return self.offset(mid)
+
+        return None
+
+    def offset(self, i: int) -> int:
+        (offset,) = struct.unpack_from('>I', self.idx, self.offsets + i * 4)
+
+        if offset & 0x80000000:
+            (offset,) = struct.unpack_from(
+                '>Q', self.idx, self.large_offsets + (offset & 0x7fffffff) * 8
+            )
+
+        return offset
+
+    def header(self, offset: int) -> (int, int, int):
+        """
+        Reads the object header and returns the type, the inflated size and
+        the offset of the data.
+        """
+
+        byte = self.pack[offset]
+        offset += 1
+
+        type = (byte >> 4) & 7
+        size = byte & 0x0f
+        shift = 4
+
+        while byte & 0x80:
+            byte = self.pack[offset]
+            offset += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+
+        return type, size, offset
+
+    def inflate(self, offset: int, size: int) -> bytes:
+        inflater = zlib.decompressobj()
+        result = b''
+
+        # feed the pack in chunks, the compressed size is not known but most
+        # objects are small and fit into the first chunk
+        length = min(size + 256, INFLATE_CHUNK)
+
+        while not inflater.eof:
+            chunk = self.pack[offset:offset + length]
+            if len(chunk) == 0:
+                raise ValueError('truncated pack')
+
+            result += inflater.decompress(chunk)
+            offset += length
+            length = INFLATE_CHUNK
+
+        if len(result) != size:
+            raise ValueError('object has wrong size')
+
+        return result
+
+
+@dataclasses.dataclass
+class Commit:
+    sha: str
+    tree: str
+    parents: list[str]
+    author: bytes
+    message: bytes
+
+
+class CommitGraph:
+    """
+    Reader for the commit-graph file or a chain of commit-graph files. Gives
+    access to the parents and the generation number of a commit without
+    inflating the commit object.
+    """
+
+    def __init__(self, paths: list[str]):
+        self.layers = []
+        base = 0
+
+        for path in paths:
+            data = map_file(path)
+            if data is None or data[:6] != b'CGPH\1\1':
+                raise ValueError('unsupported commit-graph')
+
+            chunks = {}
+            for i in range(data[6]):
+                id, offset = struct.unpack_from('>4sQ', data, 8 + i * 12)
+                chunks[id] = offset
+
+            fanout = struct.unpack_from('>256I', data, chunks[b'OIDF'])
+            self.layers.append((data, base, fanout, chunks))
+            base += fanout[255]
+
+    def position(self, sha: bytes) -> int | None:
+        for data, base, fanout, chunks in self.layers:
+            lo = fanout[sha[0] - 1] if sha[0] > 0 else 0
+            hi = fanout[sha[0]]
+
+            while lo < hi:
+                mid = (lo + hi) // 2
+                start = chunks[b'OIDL'] + mid * 20
+                name = data[start:start + 20]
+
+                if name < sha:
+                    lo = mid + 1
+                elif name > sha:
+                    hi = mid
+                else:
+                    return base + mid
+
+        return None
+
+    def layer(self, position: int):
+        for layer in reversed(self.layers):
+            if position >= layer[1]:
+                return layer
+
+    def entry(self, position: int) -> (list[int], int):
+        """
+        Gets the parent positions and the generation number of a commit.
+        """
+
+        data, base, _, chunks = self.layer(position)
+        offset = chunks[b'CDAT'] + (position - base) * 36
+
+        first, second, generation, _ = struct.unpack_from(
+            '>IIII', data, offset + 20
+        )
+
+        parents = []
+        if first != GRAPH_NO_PARENT:
+            parents.append(first)
+
+        if second & 0x80000000:
+            # octopus merge, the remaining parents are in the edge list
+            edge = chunks[b'EDGE'] + (second & 0x7fffffff) * 4
+
+            while True:
+                (value,) = struct.unpack_from('>I', data, edge)
+                parents.append(value & 0x7fffffff)
+
+                if value & 0x80000000:
+                    break
+
+                edge += 4
+
+        elif second != GRAPH_NO_PARENT:
+            parents.append(second)
+
+        return parents, generation >> 2
+
+    def sha(self, position: int) -> bytes:
+        data, base, _, chunks = self.layer(position)
+        start = chunks[b'OIDL'] + (position - base) * 20
+        return data[start:start + 20]
+
+
+class Odb:
+    """
+    Read-only access to the object database of a repository. Every method
+    returns None if the query cannot be answered, in which case the caller
+    should fall back to the git cli.
+    """
+
+    def __init__(self, git_dir: str, common_dir: str, default_date: bool):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.default_date = default_date
+        self.cache = {}
+        self.packs = {}
+        self.graph = self.load_graph()
+
+        self.objects = [os.path.join(common_dir, 'objects')]
+        try:
+            alternates = os.path.join(self.objects[0], 'info', 'alternates')
+            with open(alternates, 'rt') as f:
+                self.objects += [
+                    os.path.join(self.objects[0], it.strip())
+                    for it in f if it.strip() and not it.startswith('#')
+                ]
+        except FileNotFoundError:
+            pass
+
+        self.scan()
+
+    def load_graph(self) -> CommitGraph | None:
+        info = os.path.join(self.common_dir, 'objects', 'info')
+
+        try:
+            chain = os.path.join(info, 'commit-graphs', 'commit-graph-chain')
+            if os.path.exists(chain):
+                with open(chain, 'rt') as f:
+                    paths = [
+                        os.path.join(info, 'commit-graphs', 'graph-%s.graph'
+                                     % it.strip())
+                        for it in f if it.strip()
+                    ]
+                return CommitGraph(paths)
+
+            path = os.path.join(info, 'commit-graph')
+            if os.path.exists(path):
+                return CommitGraph([path])
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+        return None
+
+    def scan(self) -> bool:
+        """
+        Opens all pack files that are not opened yet. Returns true if new packs
+        were found.
+        """
+
+        found = False
+
+        for objects in self.objects:
+            dir = os.path.join(objects, 'pack')
+
+            try:
+                names = os.listdir(dir)
+            except FileNotFoundError:
+                continue
+
+            for name in names:
+                if not name.endswith('.idx'):
+                    continue
+
+                path = os.path.join(dir, name.removesuffix('.idx'))
+                if path in self.packs:
+                    continue
+
+                try:
+                    self.packs[path] = Pack(path)
+                    found = True
+                except (OSError, ValueError):
+                    continue
+
+        return found
+
+    def read_packed(self, pack: Pack,
+                    offset: int) -> tuple[int, bytes] | None:
+        """
+        Reads an object from the pack. Returns None if the base of a delta is
+        missing, e.g. in a thin or partial clone.
+        """
+
+        key = (id(pack), offset)
+        if key in self.cache:
+            return self.cache[key]
+
+        type, size, data = pack.header(offset)
+
+        if type == OBJ_OFS_DELTA:
+            byte = pack.pack[data]
+            data += 1
+            base = byte & 0x7f
+
+            while byte & 0x80:
+                byte = pack.pack[data]
+                data += 1
+                base = ((base + 1) << 7) | (byte & 0x7f)
+
+            base = self.read_packed(pack, offset - base)
+            if base is None:
+                return None
+
+            type, base_data = base
+            result = (type, apply_delta(base_data, pack.inflate(data, size)))
+
+        elif type == OBJ_REF_DELTA:
+            base = self.read(bytes(pack.pack[data:data + 20]))
+            if base is None:
+                return None
+
+            type, base_data = base
+            delta = pack.inflate(data + 20, size)
+            result = (type, apply_delta(base_data, delta))
+
+        else:
+            result = (type, pack.inflate(data, size))
+
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+        self.cache[key] = result
+
+        return result
+
+    def read_loose(self, sha: bytes) -> tuple[int, bytes] | None:
+        name = sha.hex()
+
+        for objects in self.objects:
+            try:
+                with open(os.path.join(objects, name[:2], name[2:]), 'rb') as f:
+                    data = zlib.decompress(f.read())
+            except FileNotFoundError:
+                continue
+
+            header, _, data = data.partition(b'\0')
+            type, _ = header.split(b' ')
+
+            return TYPES[type], data
+
+        return None
+
+    def read(self, sha: bytes) -> tuple[int, bytes] | None:
+        """
+        Reads the type and the content of an object.
+        """
+
+        for _ in range(2):
+            for pack in self.packs.values():
+                offset = pack.find(sha)
+
+                if offset is not None:
+                    return self.read_packed(pack, offset)
+
+            loose = self.read_loose(sha)
+            if loose is not None:
+                return loose
+
+            # the object might be in a pack created since the last scan
+            if not self.scan():
+                break
+
+        return None
+
+    def read_ref(self, name: str) -> str | None:
+        """
+        Reads a ref from the loose ref files or the packed-refs file and
+        follows symbolic refs.
+        """
+
+        # per worktree refs are stored in the git dir, all others in the
+        # common dir
+        if '/' not in name or name.startswith('refs/bisect/'):
+            dir = self.git_dir
+        else:
+            dir = self.common_dir
+
+        try:
+            with open(os.path.join(dir, name), 'rt') as f:
+                value = f.readline().strip()
+
+            if value.startswith('ref: '):
+                return self.read_ref(value[5:])
+
+            # FETCH_HEAD contains additional info after the hash
+            value = value.split('\t')[0]
+
+            if len(value) == 40:
+                return value
+
+            return None
+
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            pass
+
+        try:
+            with open(os.path.join(self.common_dir, 'packed-refs'), 'rt') as f:
+                for line in f:
+                    if line.startswith(('#', '^')):
+                        continue
+
+                    sha, ref = line.strip().split(' ', 1)
+                    if ref == name:
+                        return sha
+
+        except FileNotFoundError:
+            pass
+
+        return None
+
+    def resolve(self, rev: str, peel: bool = True) -> str | None:
+        """
+        Resolves a full hash or a ref name to a commit hash. Annotated tags are
+        peeled to their commit, unless peel is false. Revisions with suffixes
+        or abbreviated hashes are not supported.
+        """
+
+        if len(rev) == 40 and all(it in '0123456789abcdef' for it in rev):
+            sha = rev
+        elif any(it in rev for it in '~^:@{}'):
+            return None
+        else:
+            for rule in REF_RULES:
+                sha = self.read_ref(rule % rev)
+                if sha is not None:
+                    break
+            else:
+                return None
+
+        if not peel:
+            return sha
+
+        # peel annotated tags
+        while True:
+            object = self.read(bytes.fromhex(sha))
+            if object is None:
+                return None
+
+            type, data = object
+            if type == OBJ_COMMIT:
+                return sha
+            if type != OBJ_TAG:
+                return None
+
+            sha = data[7:47].decode()
+
+    def commit(self, rev: str) -> Commit | None:
+        sha = self.resolve(rev)
+        if sha is None:
+            return None
+
+        object = self.read(bytes.fromhex(sha))
+        if object is None or object[0] != OBJ_COMMIT:
+            return None
+
+        header, _, message = object[1].partition(b'\n\n')
+
+        tree, parents, author = None, [], None
+
+        for line in header.split(b'\n'):
+            key, _, value = line.partition(b' ')
+
+            if key == b'tree':
+                tree = value.decode()
+            elif key == b'parent':
+                parents.append(value.decode())
+            elif key == b'author':
+                author = value
+            elif key == b'encoding' and value.lower() not in [b'utf-8',
+                                                              b'utf8']:
+                return None
+
+        return Commit(sha, tree, parents, author, message)
+
+    def tree(self, sha: str) -> list[tuple[bytes, bytes, str]] | None:
+        """
+        Parses a tree object into a list of mode, name and hash.
+        """
+
+        object = self.read(bytes.fromhex(sha))
+        if object is None or object[0] != OBJ_TREE:
+            return None
+
+        data = object[1]
+        entries = []
+        i = 0
+
+        while i < len(data):
+            space = data.index(b' ', i)
+            null = data.index(b'\0', space)
+
+            entries.append((
+                data[i:space],
+                data[space + 1:null],
+                data[null + 1:null + 21].hex(),
+            ))
+            i = null + 21
+
+        return entries
+
+    def tree_files(self, sha: str, prefix: str) -> list[str] | None:
+        """
+        Lists all files in the tree. Returns None if any tree is missing.
+        """
+
+        entries = self.tree(sha)
+        if entries is None:
+            return None
+
+        files = []
+
+        for mode, name, entry in entries:
+            path = prefix + name.decode()
+
+            if mode != b'40000':
+                files.append(path)
+                continue
+
+            subtree = self.tree_files(entry, path + '/')
+            if subtree is None:
+                return None
+
+            files += subtree
+
+        return files
+
+    def diff_trees(self, a: str | None, b: str | None,
+                   prefix: str) -> list[str] | None:
+        """
+        Lists the paths of all files that differ between the two trees.
+        Returns None if any of the trees is missing.
+        """
+
+        def entries(sha: str | None) -> dict | None:
+            if sha is None:
+                return {}
+
+            tree = self.tree(sha)
+            if tree is None:
+                return None
+
+            return {name: (mode, entry) for mode, name, entry in tree}
+
+        a_entries = entries(a)
+        b_entries = entries(b)
+
+        if a_entries is None or b_entries is None:
+            return None
+
+        # git sorts tree entries as if directories had a trailing slash
+        def key(name: bytes) -> bytes:
+            mode = (b_entries.get(name) or a_entries.get(name))[0]
+            return name + b'/' if mode == b'40000' else name
+
+        files = []
+
+        for name in sorted(a_entries.keys() | b_entries.keys(), key=key):
+            a_mode, a_sha = a_entries.get(name, (None, None))
+            b_mode, b_sha = b_entries.get(name, (None, None))
+
+            if a_mode == b_mode and a_sha == b_sha:
+                continue
+
+            path = prefix + name.decode()
+            a_tree = a_sha if a_mode == b'40000' else None
+            b_tree = b_sha if b_mode == b'40000' else None
+
+            # a file sorts before a directory with the same name
+            if (a_mode is not None and a_tree is None) or \
+                    (b_mode is not None and b_tree is None):
+                files.append(path)
+
+            if a_tree is not None or b_tree is not None:
+                subtree = self.diff_trees(a_tree, b_tree, path + '/')
+                if subtree is None:
+                    return None
+
+                files += subtree
+
+        return files
+
+    def list_files(self, rev: str) -> list[str] | None:
+        """
+        Lists all files modified by the commit, like git diff-tree.
+        """
+
+        commit = self.commit(rev)
+        if commit is None:
+            return None
+
+        # diff-tree shows nothing for root and merge commits
+        if len(commit.parents) != 1:
+            return []
+
+        parent = self.commit(commit.parents[0])
+        if parent is None:
+            return None
+
+        return self.diff_trees(parent.tree, commit.tree, '')
+
+    def log(self, rev: str, format: str) -> str | None:
+        """
+        Formats a single commit like git log with the format. Only a few
+        formats are supported.
+        """
+
+        if format not in FORMATS:
+            return None
+        if format == '%ad' and not self.default_date:
+            return None
+
+        commit = self.commit(rev)
+        if commit is None:
+            return None
+
+        if format == '%H':
+            return commit.sha
+        if format == '%s':
+            return format_subject(commit.message)
+        if format == '%b':
+            return format_body(commit.message)
+
+        return format_date(commit.author, format == '%as')
+
+    def is_ancestor(self, ancestor: str, rev: str) -> bool | None:
+        """
+        Checks if the commit is an ancestor of the revision. The walk is pruned
+        by the generation numbers of the commit-graph and therefore requires
+        the ancestor to be in the commit-graph.
+        """
+
+        if self.graph is None:
+            return None
+
+        target_sha = self.resolve(ancestor)
+        tip_sha = self.resolve(rev)
+        if target_sha is None or tip_sha is None:
+            return None
+
+        target = self.graph.position(bytes.fromhex(target_sha))
+        if target is None:
+            return None
+
+        _, target_generation = self.graph.entry(target)
+
+        # commits newer than the commit-graph have to be read from objects
+        # until the walk reaches the commit-graph
+        shas = [tip_sha]
+        positions = []
+        seen = set()
+
+        while len(shas) > 0:
+            sha = shas.pop()
+            if sha == target_sha:
+                return True
+            if sha in seen:
+                continue
+            seen.add(sha)
+
+            position = self.graph.position(bytes.fromhex(sha))
+            if position is not None:
+                positions.append(position)
+                continue
+
+            commit = self.commit(sha)
+            if commit is None:
+                return None
+
+            shas += commit.parents
+
+        while len(positions) > 0:
+            position = positions.pop()
+            if position == target:
+                return True
+            if position in seen:
+                continue
+            seen.add(position)
+
+            parents, generation = self.graph.entry(position)
+
+            # a commit can only reach commits with a lower generation
+            if generation <= target_generation:
+                continue
+
+            positions += parents
+
+        return False
+
+
+def format_subject(message: bytes) -> str:
+    """
+    Formats the subject of a commit message like %s. The first paragraph is
+    joined into a single line.
+    """
+
+    lines = message.decode().split('\n')
+
+    while len(lines) > 0 and lines[0].strip() == '':
+        lines.pop(0)
+
+    subject = []
+    for line in lines:
+        if line.strip() == '':
+            break
+        subject.append(line.strip())
+
+    return ' '.join(subject)
+
+
+def format_body(message: bytes) -> str:
+    """
+    Formats the body of a commit message like %b, everything after the first
+    paragraph.
+    """
+
+    lines = message.decode().split('\n')
+    i = 0
+
+    # skip leading blank lines, the subject and the following blank lines
+    while i < len(lines) and lines[i].strip() == '':
+        i += 1
+    while i < len(lines) and lines[i].strip() != '':
+        i += 1
+    while i < len(lines) and lines[i].strip() == '':
+        i += 1
+
+    return '\n'.join(lines[i:])
+
+
+def format_date(author: bytes, short: bool) -> str:
+    """
+    Formats the author date in the default git format or as iso date if short
+    is true, both in the timezone of the author.
+    """
+
+    timestamp, zone = author.rsplit(b' ', 2)[1:]
+
+    sign = -1 if zone.startswith(b'-') else 1
+    offset = sign * (int(zone[1:3]) * 60 + int(zone[3:5]))
+
+    date = datetime.datetime.fromtimestamp(int(timestamp), datetime.UTC)
+    date += datetime.timedelta(minutes=offset)
+
+    if short:
+        return date.strftime('%Y-%m-%d')
+
+    return '%s %s %d %s %d %s' % (
+        WEEKDAYS[date.weekday()],
+        MONTHS[date.month - 1],
+        date.day,
+        date.strftime('%H:%M:%S'),
+        date.year,
+        zone.decode(),
+    )
+
+
+@functools.cache
+def odb_open(repo: str) -> Odb | None:
+    """
+    Opens the object database of the repository. Returns None if the repository
+    uses features the reader does not support.
+    """
+
+    try:
+        git_dir, common_dir, format = subprocess.check_output(
+            [
+                'git',
+                'rev-parse',
+                '--git-dir',
+                '--git-common-dir',
+                '--show-object-format',
+            ],
+            cwd=repo,
+        ).decode().split()
+
+        date = subprocess.run(
+            ['git', 'config', '--get', 'log.date'],
+            cwd=repo,
+            capture_output=True,
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+    git_dir = os.path.join(repo, git_dir)
+    common_dir = os.path.join(repo, common_dir)
+
+    if format != 'sha1':
+        return None
+
+    # shallow clones and replace refs change the history seen by git
+    if os.path.exists(os.path.join(common_dir, 'shallow')):
+        return None
+    if os.path.isdir(os.path.join(common_dir, 'refs', 'replace')):
+        return None
+
+    return Odb(git_dir, common_dir, date in [b'', b'default'])
+
+
+def odb_enable():
+    global ENABLED
+    ENABLED = True
+
+
+def odb_disable():
+    global ENABLED
+    ENABLED = False
+
+
+def odb_get(repo: str) -> Odb | None:
+    """
+    Gets the object database of the repository if the reader is enabled and
+    supports the repository.
+    """
+
+    if not ENABLED:
+        return None
+
+    return odb_open(repo)
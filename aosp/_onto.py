@@ -0,0 +1,132 @@
+import argparse
+import os
+
+from ._consts import INTELLIJ_ORIGIN
+from ._git import (
+    git_setup_intellij,
+    git_fetch_branches,
+    git_parse_rev,
+    git_update_ref,
+    git_worktree_checkout,
+    git_cache_dir,
+)
+from ._ledger import ledger_set
+from ._patch import (
+    patch_generate,
+    patch_apply_in_memory,
+    patch_cache_store,
+    patch_cache_load,
+)
+from ._review import generate_stat
+from ._test import run_suite
+from ._trace import traced
+from ._util import log, log_error
+
+WORKTREE_DIR = 'worktrees'
+
+
+def onto_branch(target: str, aosp_commit: str) -> str:
+    return 'AOSP/%s/%s' % (target, aosp_commit)
+
+
+def worktree_path(repo: str, target: str) -> str:
+    name = target.replace('/', '_')
+    return os.path.join(git_cache_dir(repo), WORKTREE_DIR, name)
+
+
+@traced
+def apply_onto(repo: str, patch: str, aosp_commit: str, target: str) -> dict:
+    """
+    Applies the patch to the target branch without a checkout and points the
+    pick branch of the target to the result.
+    """
+
+    pick, conflicts = patch_apply_in_memory(
+        repo, patch, '%s/%s' % (INTELLIJ_ORIGIN, target)
+    )
+
+    if pick is None:
+        return {'pick': None, 'conflicts': conflicts, 'stat': None}
+
+    git_update_ref(
+        repo, 'refs/heads/%s' % onto_branch(target, aosp_commit), pick
+    )
+
+    return {
+        'pick': pick,
+        'conflicts': [],
+        'stat': generate_stat(repo, pick, aosp_commit),
+    }
+
+
+def format_outcome(target: str, outcome: dict) -> str:
+    if outcome['pick'] is None:
+        status = 'conflicts in %d files' % len(outcome['conflicts'])
+    else:
+        status = 'clean (%d (+), %d (-))' % tuple(outcome['stat'] or (0, 0))
+
+    test = {None: '-', True: 'passed', False: 'failed'}[outcome.get('test')]
+
+    return '%-24s %-28s %s' % (target, status, test)
+
+
+@traced
+def pick_onto(args: argparse.Namespace):
+    """
+    Picks the aosp commit onto multiple intellij branches. The patch is
+    generated once and applied to all branches concurrently, the tests run
+    for every clean pick in a worktree of the pick branch.
+    """
+
+    # imported lazily, only the fan-out needs a thread pool
+    from concurrent.futures import ThreadPoolExecutor
+
+    repo = args.repo
+    targets = [it.strip() for it in args.onto.split(',') if it.strip()]
+    if len(targets) == 0:
+        log_error('no branches in --onto %s' % args.onto)
+
+    # the aosp remote is already fetched by `aosp pick` for the PR check
+    git_setup_intellij(repo)
+    git_fetch_branches(repo, INTELLIJ_ORIGIN, targets)
+
+    aosp_commit = git_parse_rev(repo, args.commit)
+    ledger_set(aosp_commit=aosp_commit)
+    patch = patch_cache_load(repo, aosp_commit)
+
+    if patch is None:
+        patch = patch_generate(repo, aosp_commit)
+        patch_cache_store(repo, aosp_commit, patch)
+    else:
+        log('using precomputed patch')
+
+    with ThreadPoolExecutor(len(targets)) as executor:
+        futures = {
+            it: executor.submit(apply_onto, repo, patch, aosp_commit, it)
+            for it in targets
+        }
+
+        outcomes = {key: future.result() for key, future in futures.items()}
+
+    # the bazel servers of the worktrees would compete for the same cores and
+    # memory, the suites therefore run one after the other
+    if not args.notest:
+        for target, outcome in outcomes.items():
+            if outcome['pick'] is None:
+                continue
+
+            path = worktree_path(repo, target)
+            log('testing %s in %s' % (target, path))
+
+            git_worktree_checkout(repo, path, outcome['pick'])
+            outcome['test'] = run_suite(path, args)
+
+    for target, outcome in outcomes.items():
+        print(format_outcome(target, outcome))
+
+    clean = [it for it in targets if outcomes[it]['pick'] is not None]
+    ledger_set(outcome='picked' if len(clean) > 0 else 'not applied')
+    log('picked onto %d of %d branches' % (len(clean), len(targets)))
+
+    for target in clean:
+        log('branch %s' % onto_branch(target, aosp_commit))
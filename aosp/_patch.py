@@ -1,23 +1,39 @@
 import sys
 import subprocess
 import argparse
+import codecs
+import functools
+import hashlib
+import json
 import os
+import tempfile
 
 from unidiff import PatchSet, PatchedFile
 
 from ._git import (
+    git_cache_dir,
     git_setup_aosp,
     git_log,
+    git_parse_rev,
     git_rebase_in_progress,
     git_try_read_aosp_commit,
 )
 
-from ._deaosp import process as deaosp
+from .__about__ import __version__
+from ._deaosp import process as deaosp, REPLACEMENTS
+from ._ledger import ledger_set, stage
+from ._rerere import RERERE, rerere_try_resolve
+from ._trace import traced
 from ._util import log, log_error, filter_none, choose
 
 MAGIC_DATE = 'From %s Mon Sep 17 00:00:00 2001'
 AUTHOR = 'Googler <intellij-github@google.com>'
 
+PATCH_CACHE_DIR = 'patches'
+
+# modules whose code shapes the generated patch
+PATCH_MODULES = ['_patch.py', '_deaosp.py']
+
 IGNORED_DIRECTORIES = [
     'aswb',
     'ijwb',
@@ -26,6 +42,7 @@ IGNORED_DIRECTORIES = [
 ]
 
 
+@traced
 def patch_generate_diff(repo: str, commit: str) -> PatchSet:
     """
     Generates and parsed the git diff for the patch.
@@ -110,6 +127,7 @@ def patch_process_file(file: PatchedFile) -> str | None:
     return str(file)
 
 
+@traced
 def patch_process(diff: PatchSet) -> str:
     """
     Processes every file in the commit and concatenates the result to on patch.
@@ -135,6 +153,7 @@ def patch_generate_header(repo: str, commit: str) -> str:
     return '\n'.join([date, author, author_date, subject, '', body, aosp])
 
 
+@traced
 def patch_apply(repo: str, patch: str, reject: bool) -> bool:
     """
     Applies the commit to the current branch. Uses a 3 way merge to handle any
@@ -143,7 +162,7 @@ def patch_apply(repo: str, patch: str, reject: bool) -> bool:
 
     result = subprocess.run(
         ['git', 'am', '--reject', '--no-3way', '--ignore-whitespace']
-        if reject else ['git', 'am', '--3way', '--ignore-whitespace'],
+        if reject else ['git', *RERERE, 'am', '--3way', '--ignore-whitespace'],
         cwd=repo,
         input=bytes(patch, encoding='utf-8'),
         stderr=sys.stdout,
@@ -153,6 +172,134 @@ def patch_apply(repo: str, patch: str, reject: bool) -> bool:
     return result.returncode == 0
 
 
+def git_mailinfo(repo: str, patch: str) -> (dict, bytes):
+    """
+    Parses the mail header of the patch the same way `git am` does. Returns
+    the header fields and the commit message.
+    """
+
+    with tempfile.TemporaryDirectory() as dir:
+        msg = os.path.join(dir, 'msg')
+
+        output = subprocess.check_output(
+            ['git', 'mailinfo', msg, os.path.join(dir, 'patch')],
+            cwd=repo,
+            input=bytes(patch, encoding='utf-8'),
+        )
+
+        with open(msg, 'rb') as f:
+            body = f.read()
+
+    info = dict(
+        line.split(': ', 1) for line in output.decode().splitlines()
+        if ': ' in line
+    )
+    message = info.get('Subject', '').encode() + b'\n\n' + body
+
+    return info, message
+
+
+@traced
+def patch_apply_in_memory(repo: str, patch: str,
+                          base: str = 'HEAD') -> (str | None, list[str]):
+    """
+    Applies the patch with a 3 way merge to a temporary index based on the
+    base commit, without touching the index or the working tree. Returns the
+    commit for the result if the patch applies cleanly and the conflicting
+    files.
+    """
+
+    with tempfile.TemporaryDirectory() as dir:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(dir, 'index'))
+
+        subprocess.check_call(['git', 'read-tree', base], cwd=repo, env=env)
+
+        result = subprocess.run(
+            ['git', 'apply', '--cached', '--3way', '--ignore-whitespace'],
+            cwd=repo,
+            env=env,
+            input=bytes(patch, encoding='utf-8'),
+            capture_output=True,
+        )
+
+        if result.returncode != 0:
+            output = subprocess.check_output(
+                ['git', 'ls-files', '--unmerged', '-z'],
+                cwd=repo,
+                env=env,
+            )
+            conflicts = {
+                it.split(b'\t', 1)[1].decode()
+                for it in output.split(b'\0') if it
+            }
+
+            return None, sorted(conflicts)
+
+        tree = subprocess.check_output(
+            ['git', 'write-tree'],
+            cwd=repo,
+            env=env,
+        ).decode().strip()
+
+    info, message = git_mailinfo(repo, patch)
+
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME=info.get('Author', ''),
+        GIT_AUTHOR_EMAIL=info.get('Email', ''),
+    )
+    if 'Date' in info:
+        env['GIT_AUTHOR_DATE'] = info['Date']
+
+    commit = subprocess.check_output(
+        ['git', 'commit-tree', tree, '-p', base, '-F', '-'],
+        cwd=repo,
+        env=env,
+        input=message,
+    ).decode().strip()
+
+    return commit, []
+
+
+@traced
+def git_fast_forward(repo: str, commit: str):
+    """
+    Moves HEAD to the commit, only files changed by the commit are updated in
+    the working tree. Exits with the blocking files if local changes to these
+    files prevent it.
+    """
+
+    result = subprocess.run(
+        ['git', 'merge', '--ff-only', '--quiet', commit],
+        cwd=repo,
+        stderr=subprocess.PIPE,
+        stdout=sys.stdout,
+    )
+
+    if result.returncode == 0:
+        return
+
+    # most likely local changes to files of the commit block the merge
+    def files(*args: str) -> set[str]:
+        output = subprocess.check_output(['git', *args, '-z'], cwd=repo)
+        return set(it for it in output.decode().split('\0') if it)
+
+    blocking = files('diff', '--name-only', 'HEAD', commit) & (
+        files('diff', '--name-only', 'HEAD')
+        | files('ls-files', '--others', '--exclude-standard')
+    )
+
+    if len(blocking) > 0:
+        log_error('local changes to files of the patch, applied as %s:\n%s' % (
+            commit, '\n'.join('   %s' % it for it in sorted(blocking))
+        ))
+
+    log_error('could not move HEAD to the applied patch %s: %s' % (
+        commit, result.stderr.decode().strip()
+    ))
+
+
+@traced
 def patch_generate(repo: str, commit: str) -> str:
     """
     Generates a patch from the aosp commit for the idea repository.
@@ -170,6 +317,7 @@ def patch_generate(repo: str, commit: str) -> str:
     return '%s\n%s' % (header, patch)
 
 
+@traced
 def git_am_continue(repo: str):
     """
     Prepares the files and then continues the am merge. Drops the
@@ -189,13 +337,14 @@ def git_am_continue(repo: str):
         stdout=subprocess.DEVNULL,
     )
     subprocess.check_call(
-        ['git', 'am', '--continue'],
+        ['git', *RERERE, 'am', '--continue'],
         cwd=repo,
         stderr=subprocess.DEVNULL,
         stdout=subprocess.DEVNULL,
     )
 
 
+@traced
 def git_am_abort(repo: str):
     """
     Aborts an am merge and resets the git head.
@@ -215,22 +364,89 @@ def git_am_abort(repo: str):
     )
 
 
-def delete_reject_files(repo: str):
+def unquote_path(path: str) -> str:
     """
-    Deletes all reject files that might be left over.
+    Undoes the C-style quoting git applies to paths with special characters,
+    e.g. `"a/\\303\\251.txt"`.
     """
 
-    for dir, _, files in os.walk(repo):
-        for name in files:
-            if name.endswith('.rej'):
-                os.remove(os.path.join(dir, name))
+    if len(path) < 2 or path[0] != '"' or path[-1] != '"':
+        return path
+
+    return codecs.escape_decode(path[1:-1].encode())[0].decode()
+
+
+def patch_paths(patch: str) -> list[str]:
+    """
+    Gets the paths of all files touched by the patch, old and new paths. Only
+    the diff is parsed, lines of the commit message are ignored like `git am`
+    does, the diff starts at the first `diff --git` line.
+    """
+
+    start = patch.find('\ndiff --git ')
+    if start < 0:
+        return []
+
+    paths = set()
+
+    for file in PatchSet(patch[start + 1:]):
+        source = unquote_path(file.source_file)
+        target = unquote_path(file.target_file)
+
+        # new and deleted files have /dev/null on the other side
+        if source.startswith('a/'):
+            paths.add(source[2:])
+        if target.startswith('b/'):
+            paths.add(target[2:])
 
+    return sorted(paths)
 
+
+def find_reject_files(repo: str, patch: str) -> list[str]:
+    """
+    Finds the reject files `git am --reject` created for the patch. Only the
+    paths touched by the patch are checked, reject files are created next to
+    the file they belong to.
+    """
+
+    files = (path + '.rej' for path in patch_paths(patch))
+    return [it for it in files if os.path.isfile(os.path.join(repo, it))]
+
+
+@traced
+def delete_reject_files(repo: str, files: list[str]):
+    """
+    Deletes the reject files, paths are relative to the repository.
+    """
+
+    for file in files:
+        try:
+            os.remove(os.path.join(repo, file))
+        except FileNotFoundError:
+            pass
+
+
+@traced
 def try_3way_merge(repo: str, patch: str) -> bool:
     """
-    Tries to apply the patch using 3 way merge.
+    Tries to apply the patch using 3 way merge. The patch is first applied in
+    memory and only a clean result is materialized, the working tree is only
+    used to resolve conflicts.
     """
 
+    commit, conflicts = patch_apply_in_memory(repo, patch)
+
+    if commit is not None:
+        git_fast_forward(repo, commit)
+        log('patch applied')
+        return True
+
+    if len(conflicts) > 0:
+        ledger_set(conflicts=len(conflicts))
+        log('patch conflicts in:\n%s' % '\n'.join(
+            '   %s' % it for it in conflicts
+        ))
+
     success = patch_apply(repo, patch, reject=False)
 
     if success:
@@ -242,6 +458,13 @@ def try_3way_merge(repo: str, patch: str) -> bool:
         log('patch failed')
         return False
 
+    if rerere_try_resolve(repo):
+        git_am_continue(repo)
+        log('patch applied')
+        return True
+
+    ledger_set(manual=True)
+
     result = choose(
         title='patch could not be applied automaticaly',
         options=[
@@ -261,6 +484,7 @@ def try_3way_merge(repo: str, patch: str) -> bool:
     return True
 
 
+@traced
 def try_reject_merge(repo: str, patch: str) -> bool:
     """
     Tries to apply the patch by generating reject files.
@@ -272,15 +496,19 @@ def try_reject_merge(repo: str, patch: str) -> bool:
         log('patch applied')
         return True
 
+    rejects = find_reject_files(repo, patch)
+    ledger_set(conflicts=len(rejects), manual=True)
+
     result = choose(
-        title='patch could not be applied automaticaly',
+        title='patch could not be applied automaticaly, rejected hunks in:\n'
+              + '\n'.join('   %s' % it for it in rejects),
         options=[
             '[c] resolved conflicts, continue',
             '[a] abort',
         ],
     )
 
-    delete_reject_files(repo)
+    delete_reject_files(repo, rejects)
 
     if result == 'a':
         git_am_abort(repo)
@@ -293,6 +521,55 @@ def try_reject_merge(repo: str, patch: str) -> bool:
     return True
 
 
+@functools.cache
+def patch_cache_key() -> str:
+    """
+    Hashes everything that shapes the generated patch: the remapping, the
+    version and the code of the generating modules.
+    """
+
+    rules = [REPLACEMENTS, IGNORED_DIRECTORIES, AUTHOR, __version__]
+    key = hashlib.sha1(json.dumps(rules).encode())
+
+    for name in PATCH_MODULES:
+        with open(os.path.join(os.path.dirname(__file__), name), 'rb') as f:
+            key.update(f.read())
+
+    return key.hexdigest()[:12]
+
+
+def patch_cache_path(repo: str, commit: str) -> str:
+    """
+    Gets the path of the cached patch for the commit. The commit must be a
+    full hash, the name contains the cache key, patches generated with other
+    rules or code are not reused.
+    """
+
+    return os.path.join(
+        git_cache_dir(repo),
+        PATCH_CACHE_DIR,
+        '%s-%s.patch' % (commit, patch_cache_key()),
+    )
+
+
+def patch_cache_store(repo: str, commit: str, patch: str):
+    path = patch_cache_path(repo, commit)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + '.tmp', 'wt') as f:
+        f.write(patch)
+
+    os.replace(path + '.tmp', path)
+
+
+def patch_cache_load(repo: str, commit: str) -> str | None:
+    try:
+        with open(patch_cache_path(repo, commit), 'rt') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
 def configure(parser: argparse.ArgumentParser):
     parser.add_argument(
         'commit',
@@ -301,6 +578,7 @@ def configure(parser: argparse.ArgumentParser):
     )
 
 
+@traced
 def execute(args: argparse.Namespace) -> bool:
     repo = args.repo
 
@@ -313,6 +591,19 @@ def execute(args: argparse.Namespace) -> bool:
 
     git_setup_aosp(repo)
 
-    patch = patch_generate(repo, args.commit)
+    # the ledger and the patch cache are keyed by the full hash, abbreviated
+    # hashes or refs would miss the entries of the commit
+    commit = git_parse_rev(repo, args.commit)
+    ledger_set(aosp_commit=commit)
+
+    # patches of new aosp commits are generated ahead of time by `aosp watch`
+    patch = patch_cache_load(repo, commit)
+
+    if patch is None:
+        with stage('generate'):
+            patch = patch_generate(repo, commit)
+    else:
+        log('using precomputed patch')
 
-    return try_3way_merge(repo, patch) or try_reject_merge(repo, patch)
+    with stage('apply'):
+        return try_3way_merge(repo, patch) or try_reject_merge(repo, patch)
@@ -3,21 +3,40 @@ import subprocess
 import sys
 
 from ._git import (
+    git_setup_aosp,
     git_setup_intellij,
-    git_rebase_in_progress,
     git_log,
     git_read_aosp_commit,
     git_list_files,
     git_parse_rev,
+    git_has_changes,
+    git_merge_tree,
+    git_commit_tree,
+    git_update_ref,
+    git_push_branches,
 )
 
 from ._patch import execute as patch, configure as patch_configure
 from ._test import execute as test, configure as test_configure
+from ._prs import prs_index, format_pr
+from ._ledger import ledger_set, stage
+from ._onto import pick_onto
+from ._push import push_queue_add
+from ._rerere import RERERE, rerere_try_resolve
 from ._review import generate_stat, show_diff_diff, show_range_diff
-from ._consts import INTELLIJ_REF, AOSP_URL
+from ._consts import INTELLIJ_REF, INTELLIJ_BRANCH, AOSP_URL
+from ._github import (
+    GitHubError,
+    GITHUB_REPO,
+    REVIEWERS,
+    github_client,
+    github_owner,
+)
+from ._trace import traced
 from ._util import log, log_error, choose, ask, first
 
 
+@traced
 def git_branch(repo: str, src: str, name: str):
     """
     Branches from a specific branch and checks it out.
@@ -45,33 +64,14 @@ def git_branch(repo: str, src: str, name: str):
     )
 
 
-def git_has_changes(repo: str) -> bool:
-    """
-    Returns true if there are uncommitted changes.
-    """
-
-    output = subprocess.check_output(
-        ['git', 'status', '-s'],
-        cwd=repo,
-    )
-
-    for line in output.decode().splitlines():
-        # ignore the always changing lock file
-        if 'MODULE.bazel.lock' in line:
-            continue
-
-        return True
-
-    return False
-
-
+@traced
 def git_cherry_pick(repo: str, commit: str) -> bool:
     """
     Runs a git cherry-pick.
     """
 
     result = subprocess.run(
-        ['git', 'cherry-pick', commit],
+        ['git', *RERERE, 'cherry-pick', commit],
         cwd=repo,
         stderr=sys.stdout,
         stdout=sys.stdout,
@@ -80,27 +80,28 @@ def git_cherry_pick(repo: str, commit: str) -> bool:
     return result.returncode == 0
 
 
-def git_cherry_pick_continue(repo: str):
-    subprocess.check_call(
-        ['git', 'cherry-pick', '--continue'],
+def git_cherry_pick_in_progress(repo: str) -> bool:
+    result = subprocess.run(
+        ['git', 'rev-parse', '--quiet', '--verify', 'CHERRY_PICK_HEAD'],
         cwd=repo,
-        stderr=subprocess.DEVNULL,
         stdout=subprocess.DEVNULL,
     )
 
+    return result.returncode == 0
 
-def git_cherry_pick_abort(repo: str):
+
+def git_cherry_pick_continue(repo: str):
     subprocess.check_call(
-        ['git', 'cherry-pick', '--abort'],
+        ['git', *RERERE, 'cherry-pick', '--continue'],
         cwd=repo,
         stderr=subprocess.DEVNULL,
         stdout=subprocess.DEVNULL,
     )
 
 
-def git_push(repo: str, branch: str):
+def git_cherry_pick_abort(repo: str):
     subprocess.check_call(
-        ['git', 'push',  '--set-upstream', 'origin', branch, '-f'],
+        ['git', 'cherry-pick', '--abort'],
         cwd=repo,
         stderr=subprocess.DEVNULL,
         stdout=subprocess.DEVNULL,
@@ -120,6 +121,7 @@ def git_checkout_reset(repo: str):
     )
 
 
+@traced
 def try_pick(repo: str, commit: str):
     """
     Tries to cherry-pick the commit.
@@ -131,10 +133,17 @@ def try_pick(repo: str, commit: str):
         log('commit picked')
         return
 
-    # if the pick failed but a rebase is in progress, there are conflicts
-    if not git_rebase_in_progress(repo):
+    # if the pick failed but is still in progress, there are conflicts
+    if not git_cherry_pick_in_progress(repo):
         log_error('pick failed')
 
+    if rerere_try_resolve(repo):
+        git_cherry_pick_continue(repo)
+        log('commit picked')
+        return
+
+    ledger_set(manual=True)
+
     result = choose(
         title='could not resolve conflicts automaticaly',
         options=[
@@ -144,6 +153,7 @@ def try_pick(repo: str, commit: str):
     )
 
     if result == 'a':
+        ledger_set(outcome='aborted')
         git_cherry_pick_abort(repo)
         git_checkout_reset(repo)
         sys.exit(0)
@@ -152,9 +162,60 @@ def try_pick(repo: str, commit: str):
     log('commit picked')
 
 
-def create_pr(repo: str, commit: str, aosp_commit: str, draft: bool):
+@traced
+def try_pick_in_place(repo: str, branch: str, commit: str) -> bool:
+    """
+    Tries to cherry-pick the commit onto the intellij branch purely in the
+    object database and points the branch to the result. Returns false if the
+    pick has conflicts that need to be resolved in the working tree.
+    """
+
+    tree = git_merge_tree(repo, '%s~1' % commit, INTELLIJ_REF, commit)
+
+    if tree is None:
+        log('pick has conflicts, checkout required')
+        return False
+
+    pick = git_commit_tree(repo, tree, INTELLIJ_REF, commit)
+    git_update_ref(repo, 'refs/heads/%s' % branch, pick)
+
+    log('commit picked')
+    return True
+
+
+def publish(repo: str, branch: str, commit: str, aosp_commit: str,
+            args: argparse.Namespace):
+    """
+    Pushes the branch and creates the PR. If the push is queued, the branch is
+    only added to the push queue and published by `aosp push` later.
+    """
+
+    if args.queue:
+        push_queue_add(
+            repo,
+            branch,
+            commit=commit,
+            aosp_commit=aosp_commit,
+            draft=args.draft,
+        )
+        log('branch queued for push')
+        ledger_set(outcome='picked')
+        return
+
+    error = git_push_branches(repo, 'origin', [branch], atomic=False)[branch]
+    if error is not None:
+        log_error('push failed: %s' % error)
+
+    log('branch pushed')
+
+    create_pr(repo, branch, commit, aosp_commit, args.draft)
+    ledger_set(outcome='picked')
+
+
+def pr_request(repo: str, branch: str, commit: str, aosp_commit: str,
+               draft: bool) -> dict:
     """
-    Uses the github cli to create a new PR.
+    Builds the github request for the PR of a pushed branch.
     """
 
     insertions, deletions = generate_stat(repo, commit, aosp_commit)
@@ -171,26 +232,42 @@ def create_pr(repo: str, commit: str, aosp_commit: str, draft: bool):
         git_log(repo, commit, '%b'),
     )
 
-    subprocess.check_call(
-        [
-            'gh',
-            'pr',
-            'create',
-            '--repo',
-            'bazelbuild/intellij',
-            '--title',
-            title,
-            '--body',
-            body,
-            '--reviewer',
-            'LeFrosch',
-        ] + (['--draft'] if draft else []),
+    # the branch is pushed to origin, which is usually a fork
+    url = subprocess.run(
+        ['git', 'config', '--get', 'remote.origin.url'],
         cwd=repo,
-        stderr=sys.stdout,
-        stdout=sys.stdout,
-    )
+        capture_output=True,
+    ).stdout.decode().strip()
+    owner = github_owner(url)
+
+    return {
+        'head': branch if owner is None else '%s:%s' % (owner, branch),
+        'base': INTELLIJ_BRANCH,
+        'title': title,
+        'body': body,
+        'draft': draft,
+        'reviewers': REVIEWERS,
+    }
+
+
+@traced
+def create_pr(repo: str, branch: str, commit: str, aosp_commit: str,
+              draft: bool):
+    """
+    Creates a new PR for the pushed branch.
+    """
 
+    request = pr_request(repo, branch, commit, aosp_commit, draft)
 
+    try:
+        pr = github_client().submit_pr(GITHUB_REPO, request)
+    except (GitHubError, OSError) as e:
+        log_error('could not create PR: %s' % e)
+
+    log('PR created: %s' % pr['html_url'])
+
+
+@traced
 def check(repo: str, commit: str, others: list[str]):
     if others is None or len(others) == 0:
         return
@@ -207,6 +284,23 @@ def check(repo: str, commit: str, others: list[str]):
         log_error('conflicts with %s at %s' % (other, first(intersection)))
 
 
+@traced
+def check_prs(repo: str, commit: str):
+    """
+    Warns if there already is an open or merged PR for the aosp commit, before
+    any time is spent on patching and testing.
+    """
+
+    pr = prs_index(repo).get(commit)
+    if pr is None or pr['state'] == 'closed':
+        return
+
+    log('commit already has a pick PR: %s (%s)' % (format_pr(pr), pr['url']))
+
+    if not ask('pick anyway?'):
+        sys.exit(0)
+
+
 def configure(parser: argparse.ArgumentParser):
     patch_configure(parser)
     test_configure(parser)
@@ -223,6 +317,18 @@ def configure(parser: argparse.ArgumentParser):
         help='creates a draft PR',
         default=False,
     )
+    parser.add_argument(
+        '--queue',
+        action='store_true',
+        help='queue the branch and push it later with `aosp push`',
+        default=False,
+    )
+    parser.add_argument(
+        '--onto',
+        type=str,
+        help='comma separated intellij branches to pick the commit onto, '
+             'e.g. b1,b2,b3',
+    )
     parser.add_argument(
         '--check',
         type=str,
@@ -231,43 +337,60 @@ def configure(parser: argparse.ArgumentParser):
     )
 
 
+@traced
 def execute(args: argparse.Namespace):
     repo = args.repo
 
     check(repo, args.commit, args.check)
 
+    # the index of pick PRs is keyed by full hashes
+    git_setup_aosp(repo)
+    check_prs(repo, git_parse_rev(repo, args.commit))
+
+    if args.onto is not None:
+        pick_onto(args)
+        return
+
     if not patch(args):
+        ledger_set(outcome='not applied')
         return
 
     if not args.notest:
-        test(args)
+        with stage('test'):
+            test(args)
 
     git_setup_intellij(repo)
 
-    while True:
-        commit = git_parse_rev(repo, 'HEAD')
-        aosp_commit = git_read_aosp_commit(repo, commit)
-
-        insertions, deletions = generate_stat(repo, commit, aosp_commit)
-
-        result = choose(
-            title='how to continue (%d (+), %d (-))' % (insertions, deletions),
-            options=[
-                '[c] create PR from commit, continue',
-                '[r] review, range',
-                '[d] review, diff',
-                '[a] abort',
-            ],
-        )
-
-        if result == 'c':
-            break
-        if result == 'r':
-            show_range_diff(repo, commit, aosp_commit)
-        if result == 'd':
-            show_diff_diff(repo, commit, aosp_commit)
-        if result == 'a':
-            return
+    # includes the time spent reviewing, which is part of the throughput
+    with stage('review'):
+        while True:
+            commit = git_parse_rev(repo, 'HEAD')
+            aosp_commit = git_read_aosp_commit(repo, commit)
+
+            insertions, deletions = generate_stat(repo, commit, aosp_commit)
+            ledger_set(drift=insertions + deletions)
+
+            result = choose(
+                title='how to continue (%d (+), %d (-))' % (
+                    insertions, deletions
+                ),
+                options=[
+                    '[c] create PR from commit, continue',
+                    '[r] review, range',
+                    '[d] review, diff',
+                    '[a] abort',
+                ],
+            )
+
+            if result == 'c':
+                break
+            if result == 'r':
+                show_range_diff(repo, commit, aosp_commit)
+            if result == 'd':
+                show_diff_diff(repo, commit, aosp_commit)
+            if result == 'a':
+                ledger_set(outcome='aborted')
+                return
 
     while git_has_changes(repo):
         if ask('there are uncommitted changes, continue anyway?'):
@@ -279,17 +402,22 @@ def execute(args: argparse.Namespace):
     log('creating PR for aosp commit %s' % aosp_commit)
 
     branch = 'AOSP/%s' % aosp_commit
+
+    # the PR commit is created without a checkout if there are no conflicts,
+    # this keeps the working tree and the incremental bazel state intact
+    if try_pick_in_place(repo, branch, commit):
+        with stage('publish'):
+            publish(repo, branch, commit, aosp_commit, args)
+        return
+
     git_branch(repo, INTELLIJ_REF, branch)
     log('checkout PR branch')
 
     try:
         try_pick(repo, commit)
 
-        git_push(repo, branch)
-        log('branch pushed')
-
-        create_pr(repo, commit, aosp_commit, args.draft)
-        log('PR created')
+        with stage('publish'):
+            publish(repo, branch, commit, aosp_commit, args)
 
     finally:
         git_checkout_reset(repo)
@@ -0,0 +1,198 @@
+import gzip
+import json
+import os
+import shutil
+import statistics
+import time
+
+from ._git import git_cache_dir
+from ._util import log, read_json, write_json
+
+# number of previous runs of the same case to compare the wall time against
+HISTORY_WINDOW = 10
+
+# maximum number of runs kept in the history
+HISTORY_SIZE = 1000
+
+# the profile artifacts are only kept for this many of the latest commits
+PROFILE_COMMITS = 20
+
+# a run is reported as regression if it is slower than the median of the
+# previous runs by this factor
+REGRESSION_FACTOR = 1.25
+
+# number of critical path components to print
+CRITICAL_PATH_SIZE = 5
+
+
+def profiles_dir(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), 'profiles')
+
+
+def profile_dir(repo: str, commit: str, target: str) -> str:
+    """
+    Gets the directory for the profile artifacts of a case run on a commit.
+    """
+
+    name = target.strip('/').replace('/', '_').replace(':', '_')
+    return os.path.join(profiles_dir(repo), commit, name)
+
+
+def profile_prune(repo: str, history: list[dict]):
+    """
+    Deletes the profile artifacts of all but the commits of the latest
+    PROFILE_COMMITS runs in the history.
+    """
+
+    keep = []
+    for entry in reversed(history):
+        if entry['commit'] not in keep:
+            keep.append(entry['commit'])
+
+        if len(keep) == PROFILE_COMMITS:
+            break
+
+    path = profiles_dir(repo)
+
+    for it in os.listdir(path):
+        if it not in keep and os.path.isdir(os.path.join(path, it)):
+            shutil.rmtree(os.path.join(path, it), ignore_errors=True)
+
+
+def profile_key(command: str, target: str, product: str, flags: list[str],
+                targets: list[str]) -> str:
+    """
+    Gets the key of the runs that are comparable in the history. Runs of a
+    subset of the targets or with other flags take a different time.
+    """
+
+    return json.dumps([command, target, product, flags, sorted(targets)])
+
+
+def profile_flags(path: str) -> list[str]:
+    """
+    Gets the bazel flags to write the json profile and the compact execution
+    log into the directory.
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    return [
+        '--profile=%s' % os.path.join(path, 'profile.json.gz'),
+        '--execution_log_compact_file=%s' % os.path.join(path, 'exec.log'),
+    ]
+
+
+def profile_load(path: str) -> list[dict]:
+    """
+    Loads all trace events from a, possibly gzipped, bazel json profile.
+    """
+
+    try:
+        with gzip.open(path, 'rt') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    # older bazel versions write a plain list of events
+    if isinstance(data, list):
+        return data
+
+    return data.get('traceEvents', [])
+
+
+def profile_phases(events: list[dict]) -> list[tuple[str, float]]:
+    """
+    Computes the time spent in each build phase in seconds. Phases are
+    delimited by the phase marker events.
+    """
+
+    markers = sorted(
+        (it['ts'], it['name']) for it in events
+        if it.get('cat') == 'build phase marker'
+    )
+    if len(markers) == 0:
+        return []
+
+    end = max(it.get('ts', 0) + it.get('dur', 0) for it in events)
+    bounds = [ts for ts, _ in markers[1:]] + [end]
+
+    return [
+        (name, (stop - start) / 1e6)
+        for (start, name), stop in zip(markers, bounds)
+    ]
+
+
+def profile_critical_path(events: list[dict]) -> list[tuple[str, float]]:
+    """
+    Gets the components of the critical path with their duration in seconds.
+    """
+
+    return [
+        (it['name'], it.get('dur', 0) / 1e6) for it in events
+        if it.get('cat') == 'critical path component'
+    ]
+
+
+def profile_history(repo: str, commit: str, target: str, key: str,
+                    wall: float, phases: list) -> float | None:
+    """
+    Appends the run to the history and returns the median wall time of the
+    previous runs with the same key, or None if there are no previous runs.
+    """
+
+    path = os.path.join(profiles_dir(repo), 'history.json')
+    history = read_json(path, [])
+
+    previous = [it['wall'] for it in history if it.get('key') == key]
+    previous = previous[-HISTORY_WINDOW:]
+
+    history.append({
+        'commit': commit,
+        'target': target,
+        'key': key,
+        'time': time.time(),
+        'wall': wall,
+        'phases': dict(phases),
+    })
+    write_json(path, history[-HISTORY_SIZE:])
+    profile_prune(repo, history)
+
+    if len(previous) == 0:
+        return None
+
+    return statistics.median(previous)
+
+
+def profile_report(repo: str, commit: str, target: str, key: str,
+                   wall: float):
+    """
+    Prints a compact summary of the profile of a run: time per phase and the
+    slowest components of the critical path. The wall time is compared to
+    previous runs with the same key to make regressions stand out.
+    """
+
+    path = profile_dir(repo, commit, target)
+    events = profile_load(os.path.join(path, 'profile.json.gz'))
+    phases = profile_phases(events)
+    critical = profile_critical_path(events)
+
+    log('profile %s: %.1fs wall' % (target, wall))
+
+    for name, seconds in phases:
+        print('   %-32s %8.1fs' % (name, seconds))
+
+    if len(critical) > 0:
+        total = sum(seconds for _, seconds in critical)
+        print('   critical path %.1fs:' % total)
+
+        slowest = sorted(critical, key=lambda it: it[1], reverse=True)
+        for name, seconds in slowest[:CRITICAL_PATH_SIZE]:
+            print('     %8.1fs %s' % (seconds, name))
+
+    median = profile_history(repo, commit, target, key, wall, phases)
+
+    if median is not None and wall > median * REGRESSION_FACTOR:
+        log('regression: %s took %.1fs, median of previous runs is %.1fs' % (
+            target, wall, median
+        ))
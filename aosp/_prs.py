@@ -0,0 +1,144 @@
+import os
+import re
+import time
+import urllib.parse
+
+from ._git import git_cache_dir
+from ._github import GitHubError, GITHUB_REPO, GitHub, github_client
+from ._trace import traced
+from ._util import log, read_json, write_json
+
+INDEX_FILE = 'prs.json'
+
+PER_PAGE = 100
+
+# the cached index is refreshed after this many seconds by commands that do
+# not need the latest state, see prs_index
+INDEX_MAX_AGE = 60 * 60
+
+# the tool creates branches named AOSP/<hash> and links the commit in the body
+BRANCH_PATTERN = re.compile(r'^AOSP/([0-9a-f]{40})$')
+BODY_PATTERN = re.compile(r'Cherry pick AOSP commit \[([0-9a-f]{40})\]')
+TITLE_PREFIX = '[AOSP-pick]'
+
+
+def prs_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), INDEX_FILE)
+
+
+def parse_pr(pr: dict) -> (str | None, dict):
+    """
+    Extracts the aosp commit and the index entry from a PR. The commit is None
+    if the PR is not a pick PR.
+    """
+
+    match = BRANCH_PATTERN.match(pr['head']['ref'])
+    if match is None and pr['title'].startswith(TITLE_PREFIX):
+        match = BODY_PATTERN.search(pr['body'] or '')
+
+    if pr['merged_at'] is not None:
+        state = 'merged'
+    else:
+        state = pr['state']
+
+    entry = {
+        'number': pr['number'],
+        'state': state,
+        'url': pr['html_url'],
+        'updated': pr['updated_at'],
+    }
+
+    return match.group(1) if match else None, entry
+
+
+@traced
+def prs_refresh(repo: str, client: GitHub) -> dict:
+    """
+    Updates the index with all PRs changed since the last refresh. PRs are
+    listed by last update, pagination stops at the first PR that is older
+    than the last refresh. The first page is requested with the ETag of the
+    last refresh, if nothing changed github answers with 304.
+    """
+
+    path = prs_path(repo)
+    index = read_json(path, {'etag': None, 'since': None, 'prs': {}})
+
+    query = urllib.parse.urlencode({
+        'state': 'all',
+        'sort': 'updated',
+        'direction': 'desc',
+        'per_page': PER_PAGE,
+    })
+
+    since = index['since']
+    etag = index['etag']
+    updated = 0
+
+    for page in range(1, 1000):
+        status, headers, prs = client.send(
+            'GET',
+            '/repos/%s/pulls?%s&page=%d' % (GITHUB_REPO, query, page),
+            extra={'If-None-Match': etag} if page == 1 and etag else None,
+        )
+
+        if status == 304:
+            break
+
+        if page == 1:
+            index['etag'] = headers.get('etag')
+            if len(prs) > 0:
+                index['since'] = prs[0]['updated_at']
+
+        for pr in prs:
+            # timestamps are ISO 8601 in UTC and can be compared as strings
+            if since is not None and pr['updated_at'] < since:
+                break
+
+            commit, entry = parse_pr(pr)
+            if commit is None:
+                continue
+
+            # a commit might be picked multiple times, prefer open PRs
+            old = index['prs'].get(commit)
+            if old is None or old['state'] != 'open' or \
+                    old['number'] == entry['number']:
+                index['prs'][commit] = entry
+                updated += 1
+
+        else:
+            if len(prs) == PER_PAGE:
+                continue
+
+        break
+
+    index['refreshed'] = time.time()
+
+    write_json(path, index)
+    log('pick PR index updated (%d changes)' % updated)
+
+    return index['prs']
+
+
+def prs_index(repo: str, refresh: bool = True,
+              max_age: float | None = None) -> dict:
+    """
+    Gets the index of pick PRs, maps the aosp commit to the PR. If refresh is
+    true the index is updated first, otherwise only if the cached index is
+    older than max_age seconds. If the update fails the cached index is used.
+    """
+
+    if not refresh and max_age is not None:
+        refreshed = read_json(prs_path(repo), {}).get('refreshed', 0)
+        refresh = time.time() - refreshed > max_age
+
+    if refresh:
+        try:
+            return prs_refresh(repo, github_client())
+        except (GitHubError, OSError) as e:
+            log('could not refresh pick PR index, using cached: %s' % e)
+
+    return read_json(prs_path(repo), {'prs': {}})['prs']
+
+
+def format_pr(entry: dict) -> str:
+    return '#%d %s' % (entry['number'], entry['state'])
@@ -0,0 +1,130 @@
+import argparse
+import os
+
+from ._git import git_cache_dir, git_branch_exists, git_push_branches
+from ._github import GITHUB_REPO, github_client
+from ._util import log, read_json, write_json
+
+QUEUE_FILE = 'push.json'
+
+
+def queue_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), QUEUE_FILE)
+
+
+def push_queue_add(repo: str, branch: str, **info):
+    """
+    Adds a branch that is ready to be pushed to the queue. Additional info is
+    stored alongside the branch and used to create the PR after the push.
+    """
+
+    path = queue_path(repo)
+
+    queue = read_json(path, {})
+    queue[branch] = info
+
+    write_json(path, queue)
+
+
+def push_queue_remove(repo: str, branches: list[str]):
+    path = queue_path(repo)
+
+    queue = read_json(path, {})
+    for branch in branches:
+        queue.pop(branch, None)
+
+    write_json(path, queue)
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--remote',
+        type=str,
+        help='remote to push the branches to',
+        default='origin',
+    )
+    parser.add_argument(
+        '--atomic',
+        action='store_true',
+        help='either push all branches or none',
+        default=False,
+    )
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help='only list the queued branches',
+        default=False,
+    )
+    parser.add_argument(
+        '--nopr',
+        action='store_true',
+        help='do not create PRs for the pushed branches',
+        default=False,
+    )
+
+
+def execute(args: argparse.Namespace):
+    # imported lazily, the pick command depends on this module
+    from ._pick import pr_request
+
+    repo = args.repo
+    queue = read_json(queue_path(repo), {})
+
+    if len(queue) == 0:
+        log('no branches queued')
+        return
+
+    if args.list:
+        for branch in queue:
+            print(branch)
+        log('%d branches queued' % len(queue))
+        return
+
+    # a deleted branch fails the push of all refs, it can never be pushed and
+    # is dropped from the queue
+    missing = [it for it in queue if not git_branch_exists(repo, it)]
+    if len(missing) > 0:
+        for branch in missing:
+            log('dropping %s, the branch no longer exists' % branch)
+            queue.pop(branch)
+
+        push_queue_remove(repo, missing)
+
+    if len(queue) == 0:
+        log('no branches queued')
+        return
+
+    log('pushing %d branches to %s' % (len(queue), args.remote))
+    results = git_push_branches(repo, args.remote, list(queue), args.atomic)
+
+    pushed = [it for it, error in results.items() if error is None]
+
+    if not args.nopr and len(pushed) > 0:
+        requests = [
+            pr_request(
+                repo,
+                branch,
+                queue[branch]['commit'],
+                queue[branch]['aosp_commit'],
+                queue[branch]['draft'],
+            )
+            for branch in pushed
+        ]
+
+        prs = github_client().submit_prs(GITHUB_REPO, requests)
+
+        # branches stay queued if the PR could not be created
+        for branch, pr in zip(list(pushed), prs):
+            if isinstance(pr, Exception):
+                results[branch] = str(pr)
+                pushed.remove(branch)
+
+    for branch, error in results.items():
+        print('%s %s%s' % (
+            'ok' if error is None else '!!',
+            branch,
+            '' if error is None else ' (%s)' % error,
+        ))
+
+    push_queue_remove(repo, pushed)
+    log('%d of %d branches published' % (len(pushed), len(results)))
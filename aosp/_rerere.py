@@ -0,0 +1,169 @@
+import argparse
+import os
+import subprocess
+import tarfile
+
+from ._git import git_cache_dir
+from ._ledger import ledger_set
+from ._trace import traced
+from ._util import log, log_error, read_json, write_json
+
+STATS_FILE = 'rerere.json'
+
+# passed to every git command that can create or conclude a conflict, git
+# records the conflict and the resolution and replays it the next time
+RERERE = ['-c', 'rerere.enabled=true']
+
+
+def rerere_dir(repo: str) -> str:
+    path = subprocess.check_output(
+        ['git', 'rev-parse', '--git-path', 'rr-cache'],
+        cwd=repo,
+    ).decode().strip()
+
+    return os.path.join(repo, path)
+
+
+def stats_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), STATS_FILE)
+
+
+def git_unmerged_files(repo: str) -> list[str]:
+    output = subprocess.check_output(
+        ['git', 'diff', '--name-only', '--diff-filter=U', '-z'],
+        cwd=repo,
+    )
+
+    return [it for it in output.decode().split('\0') if it]
+
+
+def git_rerere_remaining(repo: str) -> list[str]:
+    output = subprocess.check_output(
+        ['git', *RERERE, 'rerere', 'remaining'],
+        cwd=repo,
+    )
+
+    return output.decode().splitlines()
+
+
+@traced
+def rerere_try_resolve(repo: str) -> bool:
+    """
+    Checks if all conflicts of a failed am or cherry-pick were resolved from
+    recorded resolutions. If so, the resolved files are added to the index.
+    Returns false if there are conflicts left for manual resolution.
+    """
+
+    conflicts = git_unmerged_files(repo)
+    if len(conflicts) == 0:
+        return False
+
+    remaining = git_rerere_remaining(repo)
+    resolved = len(conflicts) - len(remaining)
+
+    stats = read_json(stats_path(repo), {'resolved': 0, 'manual': 0})
+    stats['resolved'] += resolved
+    stats['manual'] += len(remaining)
+    write_json(stats_path(repo), stats)
+
+    if resolved > 0:
+        log('%d of %d conflicts resolved from recorded resolutions' % (
+            resolved, len(conflicts)
+        ))
+
+    if len(remaining) > 0:
+        return False
+
+    ledger_set(rerere=True)
+
+    subprocess.check_call(
+        ['git', 'add', '--', *conflicts],
+        cwd=repo,
+        stderr=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+    )
+
+    return True
+
+
+def recorded_resolutions(path: str) -> list[str]:
+    """
+    Lists the conflicts in the rr-cache that have a recorded resolution.
+    """
+
+    if not os.path.isdir(path):
+        return []
+
+    return sorted(
+        it for it in os.listdir(path)
+        if os.path.isfile(os.path.join(path, it, 'postimage'))
+    )
+
+
+def rerere_export(repo: str, file: str):
+    path = rerere_dir(repo)
+    resolutions = recorded_resolutions(path)
+
+    with tarfile.open(file, 'w:gz') as tar:
+        for it in resolutions:
+            tar.add(os.path.join(path, it), arcname=it)
+
+    log('exported %d resolutions to %s' % (len(resolutions), file))
+
+
+def rerere_import(repo: str, file: str):
+    path = rerere_dir(repo)
+    existing = set(recorded_resolutions(path))
+    imported = set()
+
+    with tarfile.open(file, 'r:gz') as tar:
+        for member in tar.getmembers():
+            name = member.name.split('/')[0]
+
+            # local resolutions take precedence
+            if name in existing:
+                continue
+            if not (member.isfile() or member.isdir()):
+                continue
+
+            tar.extract(member, path, filter='data')
+            imported.add(name)
+
+    log('imported %d resolutions from %s' % (len(imported), file))
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--export',
+        type=str,
+        help='export all recorded resolutions to the archive',
+    )
+    parser.add_argument(
+        '--import',
+        type=str,
+        help='import the resolutions from the archive',
+        dest='archive',
+    )
+
+
+def execute(args: argparse.Namespace):
+    repo = args.repo
+
+    if args.export is not None and args.archive is not None:
+        log_error('either export or import resolutions')
+
+    if args.export is not None:
+        rerere_export(repo, args.export)
+        return
+
+    if args.archive is not None:
+        rerere_import(repo, args.archive)
+        return
+
+    stats = read_json(stats_path(repo), {'resolved': 0, 'manual': 0})
+    resolutions = recorded_resolutions(rerere_dir(repo))
+
+    log('%d recorded resolutions' % len(resolutions))
+    log('%d conflicts resolved automatically, %d manually' % (
+        stats['resolved'], stats['manual']
+    ))
@@ -0,0 +1,117 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from ._git import git_cache_dir
+from ._util import log, read_json, write_json
+
+LEDGER_FILE = 'results.json'
+
+# entries that have not been used for this many seconds are evicted
+MAX_AGE = 14 * 24 * 60 * 60
+
+# the least recently used entries are evicted beyond this many entries
+MAX_ENTRIES = 1000
+
+
+def results_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), LEDGER_FILE)
+
+
+def results_key(command: str, tree: str, target: str, product: str,
+                flags: list[str], targets: list[str]) -> str:
+    """
+    Computes the ledger key for a bazel invocation. Two invocations share a key
+    iff they run the same command with the same arguments on the same tree.
+    """
+
+    data = [command, tree, target, product, flags, sorted(targets)]
+    return hashlib.sha1(json.dumps(data).encode()).hexdigest()
+
+
+def results_evict(entries: dict, now: float) -> dict:
+    """
+    Applies the eviction policy. Drops all entries older than MAX_AGE and
+    keeps at most MAX_ENTRIES of the most recently used entries.
+    """
+
+    alive = [
+        (key, entry) for key, entry in entries.items()
+        if now - entry['used'] < MAX_AGE
+    ]
+    alive.sort(key=lambda it: it[1]['used'], reverse=True)
+
+    return dict(alive[:MAX_ENTRIES])
+
+
+def results_lookup(repo: str, key: str) -> bool | None:
+    """
+    Looks up the result for a key. Returns None if there is no entry for the
+    key, otherwise if the invocation passed.
+    """
+
+    path = results_path(repo)
+    entries = read_json(path, {})
+
+    entry = entries.get(key)
+    if entry is None:
+        return None
+
+    entry['used'] = time.time()
+    write_json(path, entries)
+
+    return entry['passed']
+
+
+def results_record(repo: str, key: str, passed: bool, **info):
+    """
+    Records the result of an invocation in the ledger. Additional info is
+    stored alongside the result for inspection.
+    """
+
+    path = results_path(repo)
+    now = time.time()
+
+    entries = read_json(path, {})
+    entries[key] = {**info, 'passed': passed, 'created': now, 'used': now}
+
+    write_json(path, results_evict(entries, now))
+
+
+def format_entry(entry: dict) -> str:
+    return '%s %s %s %s (%s)' % (
+        'PASS' if entry['passed'] else 'FAIL',
+        entry['tree'][:12],
+        entry['command'],
+        entry['target'],
+        time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created'])),
+    )
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--purge',
+        action='store_true',
+        help='delete all cached results',
+        default=False,
+    )
+
+
+def execute(args: argparse.Namespace):
+    path = results_path(args.repo)
+
+    if args.purge:
+        if os.path.exists(path):
+            os.remove(path)
+        log('result cache purged')
+        return
+
+    entries = results_evict(read_json(path, {}), time.time())
+    entries = sorted(entries.values(), key=lambda it: it['created'])
+
+    for entry in entries:
+        print(format_entry(entry))
+
+    log('%d cached results' % len(entries))
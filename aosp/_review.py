@@ -1,4 +1,5 @@
 import argparse
+import os
 import subprocess
 import tempfile
 import sys
@@ -10,14 +11,18 @@ from ._git import (
     git_setup_intellij,
     git_log,
     git_read_aosp_commit,
+    git_try_read_aosp_commit,
     git_parse_rev,
 )
 
 from ._patch import patch_process as aosp_process_diff
 from ._consts import INTELLIJ_ORIGIN
+from ._prs import prs_index
+from ._trace import traced
 from ._util import log, log_error
 
 
+@traced
 def git_fetch_pr(repo: str, pr: str) -> str:
     """
     Fetches the head of the pull request from GitHub and resolves the commit
@@ -33,6 +38,45 @@ def git_fetch_pr(repo: str, pr: str) -> str:
     return git_parse_rev(repo, 'FETCH_HEAD')
 
 
+def pr_ref(pr: str) -> str:
+    return 'refs/aosp/pr/%s' % pr
+
+
+@traced
+def git_fetch_prs(repo: str, prs: list[str]) -> dict[str, str]:
+    """
+    Fetches the heads of multiple pull requests with a single fetch into local
+    refs and resolves the commit hash for every head.
+    """
+
+    subprocess.check_call(
+        [
+            'git',
+            'fetch',
+            INTELLIJ_ORIGIN,
+            *('+pull/%s/head:%s' % (pr, pr_ref(pr)) for pr in prs),
+        ],
+        cwd=repo,
+    )
+    log('%d prs up to date' % len(prs))
+
+    return {pr: git_parse_rev(repo, pr_ref(pr)) for pr in prs}
+
+
+def open_pick_prs(repo: str) -> list[str]:
+    """
+    Gets the numbers of all open pick PRs from the PR index.
+    """
+
+    prs = prs_index(repo)
+
+    return sorted(
+        (str(it['number']) for it in prs.values() if it['state'] == 'open'),
+        key=int,
+    )
+
+
+@traced
 def generate_diff(repo: str, commit: str) -> PatchSet:
     """
     Generates and parsed the git diff for the patch.
@@ -57,6 +101,7 @@ def generate_diff(repo: str, commit: str) -> PatchSet:
     return patch
 
 
+@traced
 def generate_stat(repo: str, repo_commit: str, aosp_commit: str) -> (int, int):
     """
     Similar to show_diff_diff but only calculates the different insertions and
@@ -110,6 +155,7 @@ def generate_stat(repo: str, repo_commit: str, aosp_commit: str) -> (int, int):
         aosp_file.close()
 
 
+@traced
 def show_diff_diff(repo: str, repo_commit: str, aosp_commit: str):
     """
     Creates a diff from the changes applied to our repository and the changes
@@ -146,6 +192,7 @@ def show_diff_diff(repo: str, repo_commit: str, aosp_commit: str):
         aosp_file.close()
 
 
+@traced
 def show_range_diff(repo: str, repo_commit: str, aosp_commit: str):
     """
     Uses git range diff to compar the changes between our repository and the
@@ -166,6 +213,91 @@ def show_range_diff(repo: str, repo_commit: str, aosp_commit: str):
     )
 
 
+@traced
+def generate_stats(repo: str, commits: dict[str, tuple[str, str]]) -> dict:
+    """
+    Runs generate_stat for multiple pairs of repo and aosp commits in
+    parallel. The keys of the result match the keys of the input.
+    """
+
+    # imported lazily, a single review does not need a thread pool
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(os.cpu_count()) as executor:
+        futures = {
+            key: executor.submit(generate_stat, repo, *pair)
+            for key, pair in commits.items()
+        }
+
+        return {key: future.result() for key, future in futures.items()}
+
+
+def format_stat(stat: tuple[int, int] | None) -> str:
+    if stat is None:
+        return 'no stat'
+
+    return '%d (+), %d (-)' % stat
+
+
+def review(repo: str, commit: str, mode: str):
+    repo_commit = git_log(repo, commit, '%H')
+    log('reviewing: %s' % git_log(repo, repo_commit, '%s'))
+
+    aosp_commit = git_read_aosp_commit(repo, commit)
+
+    if mode == 'diff':
+        show_diff_diff(repo, repo_commit, aosp_commit)
+    elif mode == 'range':
+        show_range_diff(repo, repo_commit, aosp_commit)
+    elif mode == 'stat':
+        insertions, deletions = generate_stat(repo, repo_commit, aosp_commit)
+        log('STAT: %d insertions(+), %d deletion(-)' % (insertions, deletions))
+    else:
+        log_error('unknonw diff mode: %s' % mode)
+
+
+def review_batch(repo: str, prs: list[str], mode: str):
+    """
+    Reviews multiple PRs. Fetches all heads at once, prints a table with the
+    stat of every PR and then reviews single PRs on request.
+    """
+
+    heads = git_fetch_prs(repo, prs)
+
+    commits = {}
+    for pr, head in heads.items():
+        aosp_commit = git_try_read_aosp_commit(repo, head)
+
+        if aosp_commit is None:
+            log('pr %s is not a pick PR' % pr)
+        else:
+            commits[pr] = (head, aosp_commit)
+
+    stats = generate_stats(repo, commits)
+
+    for pr, (head, aosp_commit) in commits.items():
+        print('#%-6s %s %-24s %s' % (
+            pr,
+            aosp_commit[:12],
+            format_stat(stats[pr]),
+            git_log(repo, head, '%s'),
+        ))
+
+    if mode == 'stat':
+        return
+
+    while True:
+        pr = input('?? PR to review (empty to quit) ').strip().lstrip('#')
+
+        if pr == '':
+            break
+        if pr not in commits:
+            log('unknown PR: %s' % pr)
+            continue
+
+        review(repo, commits[pr][0], mode)
+
+
 def configure(parser: argparse.ArgumentParser):
     group = parser.add_mutually_exclusive_group(required=True)
 
@@ -177,7 +309,9 @@ def configure(parser: argparse.ArgumentParser):
     group.add_argument(
         '--pr',
         type=str,
-        help='number of the pull request to review'
+        nargs='+',
+        help='numbers of the pull requests to review, or all for all open '
+             'pick PRs',
     )
 
     parser.add_argument(
@@ -188,27 +322,23 @@ def configure(parser: argparse.ArgumentParser):
     )
 
 
+@traced
 def execute(args: argparse.Namespace):
     repo = args.repo
     git_setup_aosp(repo)
     git_setup_intellij(repo)
 
-    if args.pr:
-        commit = git_fetch_pr(repo, args.pr)
-    else:
-        commit = args.commit
-
-    repo_commit = git_log(repo, commit, '%H')
-    log('reviewing: %s' % git_log(repo, repo_commit, '%s'))
-
-    aosp_commit = git_read_aosp_commit(repo, commit)
+    if args.pr is None:
+        review(repo, args.commit, args.mode)
+        return
 
-    if args.mode == 'diff':
-        show_diff_diff(repo, repo_commit, aosp_commit)
-    elif args.mode == 'range':
-        show_range_diff(repo, repo_commit, aosp_commit)
-    elif args.mode == 'stat':
-        insertions, deletions = generate_stat(repo, repo_commit, aosp_commit)
-        log('STAT: %d insertions(+), %d deletion(-)' % (insertions, deletions))
+    if args.pr == ['all']:
+        prs = open_pick_prs(repo)
+        log('%d open pick PRs' % len(prs))
     else:
-        log_error('unknonw diff mode: %s' % args.mode)
+        prs = [it.lstrip('#') for it in args.pr]
+
+    if len(prs) == 1:
+        review(repo, git_fetch_pr(repo, prs[0]), args.mode)
+    elif len(prs) > 1:
+        review_batch(repo, prs, args.mode)
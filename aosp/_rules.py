@@ -0,0 +1,57 @@
+import argparse
+import subprocess
+
+from ._deaosp import process, profile_enable, profile_report
+from ._git import git_setup_aosp
+from ._util import log
+
+
+def process_range(repo: str, commits: str) -> int:
+    """
+    Processes every line of the aswb diffs of all commits in the range, like
+    a pick of each commit would. Returns the number of processed lines.
+    """
+
+    output = subprocess.Popen(
+        ['git', 'log', '--format=', '--patch', '--no-color', commits, '--',
+         'aswb'],
+        cwd=repo,
+        stdout=subprocess.PIPE,
+    )
+
+    lines = 0
+    for line in output.stdout:
+        process(line.decode(errors='replace'))
+        lines += 1
+
+    if output.wait() != 0:
+        log('git log failed for %s' % commits)
+
+    return lines
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        'range',
+        type=str,
+        help='range of aosp commits to profile the rules against, e.g. A..B',
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        help='number of hottest rules to report',
+        default=10,
+    )
+
+
+def execute(args: argparse.Namespace):
+    repo = args.repo
+    git_setup_aosp(repo)
+
+    profile_enable()
+
+    log('processing diffs of %s' % args.range)
+    lines = process_range(repo, args.range)
+    log('processed %d lines' % lines)
+
+    profile_report(args.top)
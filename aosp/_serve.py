@@ -0,0 +1,388 @@
+import argparse
+import importlib
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import traceback
+import zlib
+
+from .__about__ import __version__
+from ._util import log, log_error
+
+# the daemon exits after being idle for this many seconds
+IDLE_TIMEOUT = 60 * 60
+
+# maximum size of a request or response, messages are prefixed with their
+# length and read until complete
+MAX_MESSAGE = 1024 * 1024
+
+# environment variables of the client that the forwarded commands see, all
+# others stay as in the daemon
+FORWARDED_ENV = [
+    'REPO',
+    'AOSP_NATIVE_GIT',
+    'AOSP_GITHUB_API',
+    'GITHUB_TOKEN',
+    'GH_TOKEN',
+]
+
+
+def socket_path(repo: str) -> str | None:
+    """
+    Gets the path of the daemon socket for the repository. The socket lives in
+    a private runtime directory, the path of a socket is limited to about 100
+    characters and can therefore not be inside the repository. Returns None if
+    the runtime directory is not private to the user.
+    """
+
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime is None:
+        tmp = os.environ.get('TMPDIR', '/tmp')
+        runtime = os.path.join(tmp, 'aosp-%d' % os.getuid())
+        os.makedirs(runtime, mode=0o700, exist_ok=True)
+
+    # another user could have created the directory first and planted a socket
+    # that receives the environment and the terminal of the client
+    info = os.lstat(runtime)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            stat.S_IMODE(info.st_mode) != 0o700:
+        return None
+
+    # collisions are harmless, the daemon rejects requests for other repos
+    key = zlib.crc32(os.path.realpath(repo).encode())
+    return os.path.join(runtime, 'aosp-%08x.sock' % key)
+
+
+def peer_uid(connection: socket.socket) -> int | None:
+    """
+    Gets the user id of the process on the other end of the socket, None if
+    the platform does not support SO_PEERCRED.
+    """
+
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+
+    credentials = connection.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')
+    )
+    _, uid, _ = struct.unpack('3i', credentials)
+
+    return uid
+
+
+def connect(path: str) -> socket.socket:
+    """
+    Connects to the daemon socket. Raises an OSError if the daemon runs as a
+    different user.
+    """
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(path)
+
+        uid = peer_uid(connection)
+        if uid is not None and uid != os.getuid():
+            raise PermissionError('daemon runs as user %d' % uid)
+
+    except BaseException:
+        connection.close()
+        raise
+
+    return connection
+
+
+def send_message(connection: socket.socket, data: dict, fds: list[int] = []):
+    message = json.dumps(data).encode()
+    header = len(message).to_bytes(4, 'big')
+
+    # the file descriptors travel with the header
+    socket.send_fds(connection, [header], fds)
+    connection.sendall(message)
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = b''
+
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed during a message')
+
+        data += chunk
+
+    return data
+
+
+def receive_message(connection: socket.socket) -> (dict | None, list[int]):
+    header, fds, _, _ = socket.recv_fds(connection, 4, 3)
+
+    if not header:
+        return None, fds
+
+    try:
+        header += receive_exactly(connection, 4 - len(header))
+        size = int.from_bytes(header, 'big')
+
+        if size > MAX_MESSAGE:
+            raise ValueError('message of %d bytes is too large' % size)
+
+        return json.loads(receive_exactly(connection, size)), fds
+
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def serve_forward(repo: str, argv: list[str]) -> int | None:
+    """
+    Forwards the command to the daemon of the repository. The daemon runs the
+    command with the stdin, stdout and stderr of this process. Returns the exit
+    code or None if there is no daemon and the command should run in process.
+    """
+
+    path = socket_path(repo)
+    if path is None or not os.path.exists(path):
+        return None
+
+    try:
+        connection = connect(path)
+    except OSError:
+        return None
+
+    try:
+        request = {
+            'version': __version__,
+            'repo': os.path.realpath(repo),
+            'cwd': os.getcwd(),
+            'env': {
+                it: os.environ[it] for it in FORWARDED_ENV if it in os.environ
+            },
+            'argv': argv,
+        }
+        send_message(connection, request, [0, 1, 2])
+
+        response, _ = receive_message(connection)
+
+    except (OSError, ValueError):
+        return None
+
+    finally:
+        connection.close()
+
+    if response is None or 'code' not in response:
+        return None
+
+    return response['code']
+
+
+def set_environment(env: dict):
+    """
+    Sets the forwarded environment variables, variables missing in the dict
+    are removed.
+    """
+
+    for name in FORWARDED_ENV:
+        if env.get(name) is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = env[name]
+
+
+class Daemon:
+    """
+    Runs commands for a single repository. Requests are handled one after the
+    other, the commands change the working directory, the environment and the
+    standard file descriptors of the process.
+    """
+
+    def __init__(self, repo: str, run: callable):
+        self.repo = os.path.realpath(repo)
+        self.run = run
+
+    def execute(self, request: dict, fds: list[int]) -> int:
+        saved = [os.dup(it) for it in range(3)]
+        cwd = os.getcwd()
+        env = {it: os.environ.get(it) for it in FORWARDED_ENV}
+
+        try:
+            for fd, target in zip(fds, range(3)):
+                os.dup2(fd, target)
+
+            os.chdir(request['cwd'])
+
+            # the command sees the forwarded environment of the client, e.g.
+            # REPO, the github token or AOSP_NATIVE_GIT
+            set_environment(request['env'])
+
+            try:
+                self.run(request['argv'])
+                return 0
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                return 1
+
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+            os.chdir(cwd)
+            set_environment(env)
+
+            for fd, target in zip(saved, range(3)):
+                os.dup2(fd, target)
+                os.close(fd)
+
+    def handle(self, connection: socket.socket) -> bool:
+        """
+        Handles one request, returns false if the daemon should stop.
+        """
+
+        # clients of other users could be handed the terminal of commands
+        uid = peer_uid(connection)
+        if uid is not None and uid != os.getuid():
+            return True
+
+        request, fds = receive_message(connection)
+
+        try:
+            if request is None:
+                return True
+
+            if request.get('stop'):
+                send_message(connection, {'stopped': True})
+                return False
+
+            # clients of a different version run the command in process
+            if request.get('version') != __version__ or \
+                    request.get('repo') != self.repo or len(fds) != 3:
+                send_message(connection, {'rejected': True})
+                return True
+
+            code = self.execute(request, fds)
+            send_message(connection, {'code': code})
+
+            return True
+
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def serve(self, path: str, timeout: float):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        server.settimeout(timeout)
+
+        log('serving %s on %s' % (self.repo, path))
+
+        try:
+            while True:
+                try:
+                    connection, _ = server.accept()
+                except TimeoutError:
+                    log('idle timeout, stopping')
+                    break
+
+                with connection:
+                    connection.settimeout(None)
+
+                    # a broken client must not stop the daemon
+                    try:
+                        if not self.handle(connection):
+                            log('stopped')
+                            break
+                    except (OSError, ValueError, KeyError) as e:
+                        log('request failed: %s' % e)
+
+        finally:
+            server.close()
+            os.remove(path)
+
+
+def serve_stop(path: str) -> bool:
+    try:
+        connection = connect(path)
+    except OSError:
+        return False
+
+    try:
+        send_message(connection, {'stop': True})
+        receive_message(connection)
+        return True
+    except (OSError, ValueError):
+        return False
+    finally:
+        connection.close()
+
+
+def serve_running(path: str) -> bool:
+    try:
+        connect(path).close()
+        return True
+    except OSError:
+        return False
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--stop',
+        action='store_true',
+        help='stop the running daemon',
+        default=False,
+    )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        help='stop after being idle for this many seconds',
+        default=IDLE_TIMEOUT,
+    )
+
+
+def execute(args: argparse.Namespace):
+    # imported lazily, the main module imports this module for forwarding
+    from ._main import COMMANDS, FORWARDED, run
+    from ._odb import odb_disable, odb_open
+    from ._git import git_cache_dir
+
+    repo = args.repo
+    path = socket_path(repo)
+
+    if path is None:
+        log_error('the runtime directory is not private to the user')
+
+    if args.stop:
+        log('daemon stopped' if serve_stop(path) else 'no daemon running')
+        return
+
+    if serve_running(path):
+        log('daemon already running on %s' % path)
+        return
+
+    # remove the socket of a daemon that did not shut down
+    if os.path.exists(path):
+        os.remove(path)
+
+    # the object database, the memoized git directories and all imported
+    # modules stay warm between requests
+    odb_open(repo)
+    git_cache_dir(repo)
+
+    for name in FORWARDED:
+        importlib.import_module('.' + COMMANDS[name][0], __package__)
+
+    # the warm reader is only used by requests that enable it, like any other
+    # run with --native-git or AOSP_NATIVE_GIT
+    def run_request(argv: list[str]):
+        try:
+            run(argv)
+        finally:
+            odb_disable()
+
+    Daemon(repo, run_request).serve(path, args.timeout)
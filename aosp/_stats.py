@@ -0,0 +1,135 @@
+import argparse
+import os
+import time
+
+from ._ledger import ledger_connect, ledger_path
+from ._util import log
+
+DAY = 24 * 60 * 60
+
+
+def window_stats(connection, start: float, end: float) -> dict:
+    """
+    Aggregates all runs that started in the window.
+    """
+
+    window = 'runs.started >= ? AND runs.started < ?'
+
+    runs, duration = connection.execute(
+        'SELECT count(*), total(duration) FROM runs WHERE %s' % window,
+        (start, end),
+    ).fetchone()
+
+    picks = connection.execute(
+        'SELECT count(*), total(outcome = \'picked\'), total(conflicts > 0), '
+        'total(rerere), total(manual), avg(drift) FROM runs '
+        'WHERE command = \'pick\' AND %s' % window,
+        (start, end),
+    ).fetchone()
+
+    # cached results replay an earlier run, only executed first tries count
+    tests = connection.execute(
+        'SELECT count(*), total(passed) FROM cases JOIN runs ON run = id '
+        'WHERE cases.command = \'test\' AND attempt = 1 AND cached = 0 '
+        'AND %s' % window,
+        (start, end),
+    ).fetchone()
+
+    stages = connection.execute(
+        'SELECT name, count(*), total(stages.duration) FROM stages '
+        'JOIN runs ON run = id WHERE %s GROUP BY name '
+        'ORDER BY total(stages.duration) DESC' % window,
+        (start, end),
+    ).fetchall()
+
+    return {
+        'runs': runs,
+        'duration': duration,
+        'picks': picks,
+        'tests': tests,
+        'stages': stages,
+    }
+
+
+def percent(part: float, total: float) -> str:
+    return '%.0f%%' % (100 * part / total) if total > 0 else '-'
+
+
+def format_window(stats: dict, days: int) -> list[str]:
+    if stats['runs'] == 0:
+        return ['   no runs']
+
+    lines = ['   runs        %d, %.0fs in total' % (
+        stats['runs'], stats['duration']
+    )]
+
+    attempts, picked, conflicts, rerere, manual, drift = stats['picks']
+    if attempts > 0:
+        lines.append('   picks       %d of %d (%.1f per day)' % (
+            picked, attempts, picked / days
+        ))
+        lines.append('   conflicts   %s (rerere %s, manual %s)' % (
+            percent(conflicts, attempts),
+            percent(rerere, attempts),
+            percent(manual, attempts),
+        ))
+
+    if drift is not None:
+        lines.append('   drift       %.1f lines per pick' % drift)
+
+    cases, passed = stats['tests']
+    if cases > 0:
+        lines.append('   tests       %s passed on first try (%d of %d)' % (
+            percent(passed, cases), passed, cases
+        ))
+
+    for index, (name, count, total) in enumerate(stats['stages']):
+        lines.append('   %-11s %-10s %.1fs avg, %.0fs total (%dx)' % (
+            'stages' if index == 0 else '', name, total / count, total, count
+        ))
+
+    return lines
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--days',
+        type=int,
+        help='length of a window in days',
+        default=7,
+    )
+    parser.add_argument(
+        '--windows',
+        type=int,
+        help='number of windows, the most recent first',
+        default=4,
+    )
+
+
+def execute(args: argparse.Namespace):
+    repo = args.repo
+
+    if not os.path.exists(ledger_path(repo)):
+        log('no runs recorded yet')
+        return
+
+    connection = ledger_connect(repo)
+    end = time.time()
+
+    try:
+        for _ in range(args.windows):
+            start = end - args.days * DAY
+
+            log('%s to %s' % (
+                time.strftime('%Y-%m-%d', time.localtime(start)),
+                time.strftime('%Y-%m-%d', time.localtime(end)),
+            ))
+
+            stats = window_stats(connection, start, end)
+            for line in format_window(stats, args.days):
+                print(line)
+
+            end = start
+
+    finally:
+        connection.close()
@@ -2,8 +2,27 @@ import sys
 import subprocess
 import argparse
 import dataclasses
+import hashlib
+import fnmatch
+import json
+import time
+import os
 
-from ._util import log, choose, exit
+from ._git import (
+    git_cache_dir,
+    git_hash_files,
+    git_list_tree,
+    git_list_files,
+    git_try_read_aosp_commit,
+    git_has_changes,
+    git_parse_rev,
+)
+
+from ._ledger import ledger_case
+from ._profile import profile_dir, profile_flags, profile_key, profile_report
+from ._results import results_key, results_lookup, results_record
+from ._trace import traced
+from ._util import log, choose, exit, read_json, write_json
 
 
 @dataclasses.dataclass
@@ -37,62 +56,488 @@ BUILD_CASES = [
     ),
 ]
 
+# files that define bazel packages
+BUILD_FILES = ['BUILD', 'BUILD.bazel']
+
+# files that can change the build graph outside of their own package, if one
+# of these is modified the full suite has to run
+GLOBAL_FILES = [
+    '*.bzl',
+    'MODULE.bazel',
+    'WORKSPACE',
+    'WORKSPACE.bazel',
+    '.bazelrc',
+    '.bazelversion',
+]
+
+# overall test status that are considered as passed in the build event protocol
+PASSED_STATUS = ['PASSED', 'FLAKY']
+
+# bazel runners that are reported for actions served from a cache
+CACHE_HIT_RUNNERS = ['remote cache hit', 'disk cache hit']
+
+# number of runs per test when retrying failed tests to detect flakiness
+RUNS_PER_TEST = 10
+
+
+def find_build_dirs(repo: str, commit: str) -> set[str]:
+    """
+    Gets all directories with a BUILD file in the tree of the commit. The
+    tree of the commit is used instead of the working tree, which might not
+    have the commit checked out.
+    """
+
+    return {
+        os.path.dirname(it) for it in git_list_tree(repo, commit)
+        if os.path.basename(it) in BUILD_FILES
+    }
+
 
-def bazel_test(repo: str, case: Case):
+def find_package(build_dirs: set[str], file: str) -> str | None:
     """
-    Runs a bazel test command for the given target and ij_product.
+    Finds the bazel package for a file by walking up the directory tree until
+    a BUILD file is found. Returns None if the file is not part of a package.
     """
 
+    dir = os.path.dirname(file)
+
     while True:
-        log('executing test %s' % case.target)
-
-        success = subprocess.run(
-            [
-                'bazel',
-                'test',
-                case.target,
-                '--define=ij_product=%s' % case.product,
-                '--disk_cache=/tmp/bazel_cache',
-                *case.flags,
-            ],
-            cwd=repo,
-            stderr=sys.stdout,
-            stdout=sys.stdout,
-        ).returncode == 0
+        if dir in build_dirs:
+            return dir
+
+        if dir == '':
+            return None
+
+        dir = os.path.dirname(dir)
+
+
+def find_packages(repo: str, commit: str,
+                  files: list[str]) -> list[str] | None:
+    """
+    Maps the changed files to their bazel packages in the tree of the commit.
+    Returns None if any file could affect the build graph globally.
+    """
+
+    build_dirs = find_build_dirs(repo, commit)
+    packages = set()
+
+    for file in files:
+        name = os.path.basename(file)
+
+        if any(fnmatch.fnmatch(name, it) for it in GLOBAL_FILES):
+            log('global build file changed: %s' % file)
+            return None
+
+        package = find_package(build_dirs, file)
+
+        if package is None:
+            log('file outside of any package changed: %s' % file)
+            return None
+
+        packages.add(package)
+
+    return sorted(packages)
+
+
+@traced
+def bazel_query(repo: str, query: str) -> list[str] | None:
+    """
+    Runs a bazel query and returns the resulting labels or None if the query
+    failed.
+    """
+
+    result = subprocess.run(
+        ['bazel', 'query', query, '--output=label'],
+        cwd=repo,
+        capture_output=True,
+        text=True,
+    )
+
+    if result.returncode != 0:
+        log('bazel query failed, falling back to all tests')
+        return None
+
+    return result.stdout.splitlines()
+
+
+@traced
+def affected_targets(repo: str, case: Case, packages: list[str]) -> list[str]:
+    """
+    Computes the test targets of the case that depend on any of the packages.
+    The result of the reverse-dependency query is cached and keyed by the hash
+    of all BUILD files, since only those can change the dependency graph.
+    """
+
+    path = os.path.join(git_cache_dir(repo), 'affected.json')
+    build_hash = git_hash_files(repo, 'HEAD', BUILD_FILES + GLOBAL_FILES)
+
+    cache = read_json(path, {})
+
+    # entries for other BUILD trees are stale, only keep the current tree
+    if cache.get('hash') != build_hash:
+        cache = {'hash': build_hash, 'queries': {}}
+
+    tests = 'tests(%s)' % case.target
+    query = '%s intersect rdeps(%s, set(%s))' % (
+        tests,
+        tests,
+        ' '.join('//%s:*' % it for it in packages),
+    )
+    key = hashlib.sha1(query.encode()).hexdigest()
+
+    if key in cache['queries']:
+        log('using cached affected targets for %s' % case.target)
+        return cache['queries'][key]
+
+    targets = bazel_query(repo, query)
+
+    # fallback to the full case if the query cannot be evaluated
+    if targets is None:
+        return [case.target]
+
+    cache['queries'][key] = targets
+    write_json(path, cache)
+
+    return targets
+
+
+def changed_packages(repo: str) -> list[str] | None:
+    """
+    Gets the packages changed by the picked commit at HEAD. Returns None if
+    HEAD is not a picked commit or the change cannot be narrowed down.
+    """
+
+    if git_try_read_aosp_commit(repo, 'HEAD') is None:
+        log('HEAD is not a picked commit, running all tests')
+        return None
+
+    return find_packages(repo, 'HEAD', git_list_files(repo, 'HEAD'))
+
+
+def clean_tree(repo: str) -> str | None:
+    """
+    Gets the tree hash of HEAD if the working tree has no uncommitted changes,
+    otherwise None since the result of a run cannot be attributed to a tree.
+    """
+
+    if git_has_changes(repo):
+        return None
+
+    return git_parse_rev(repo, 'HEAD^{tree}')
+
+
+def bazel_key(command: str, case: Case, targets: list[str], tree: str) -> str:
+    return results_key(
+        command, tree, case.target, case.product, case.flags, targets
+    )
+
+
+def bep_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), 'bep.json')
+
+
+def bep_clear(repo: str):
+    """
+    Removes the build events of the previous run, to not report stale failures
+    if bazel does not get to write the file.
+    """
+
+    path = bep_path(repo)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def bep_failed_tests(path: str) -> list[tuple[str, list[str]]]:
+    """
+    Parses a build event protocol json file and returns the labels of all
+    failed tests together with the paths to their test logs.
+    """
+
+    failed = []
+
+    try:
+        with open(path, 'rt') as f:
+            for line in f:
+                event = json.loads(line)
+
+                label = event['id'].get('testSummary', {}).get('label')
+                if label is None:
+                    continue
+
+                summary = event.get('testSummary', {})
+                if summary.get('overallStatus') in PASSED_STATUS:
+                    continue
+
+                logs = [
+                    it['uri'].removeprefix('file://')
+                    for it in summary.get('failed', [])
+                ]
+                failed.append((label, logs))
+
+    except (OSError, ValueError, KeyError):
+        return []
+
+    return failed
+
+
+def bep_cache_stats(path: str) -> tuple[int, int] | None:
+    """
+    Reads the number of executed actions and the number of cache hits among
+    them from the build metrics of a build event protocol json file.
+    """
+
+    try:
+        with open(path, 'rt') as f:
+            for line in f:
+                event = json.loads(line)
+
+                if 'buildMetrics' not in event['id']:
+                    continue
+
+                summary = event['buildMetrics'].get('actionSummary', {})
+                runners = summary.get('runnerCount', [])
+
+                total = sum(
+                    int(it.get('count', 0)) for it in runners
+                    if it.get('name') != 'total'
+                )
+                hits = sum(
+                    int(it.get('count', 0)) for it in runners
+                    if it.get('name') in CACHE_HIT_RUNNERS
+                )
+
+                return (hits, total)
+
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return None
+
+
+def cache_flags(remote_cache: str | None) -> list[str]:
+    """
+    Gets the bazel flags for the cache, either the shared remote cache if
+    configured or the local disk cache.
+    """
+
+    if remote_cache is not None:
+        return ['--remote_cache=%s' % remote_cache]
+
+    return ['--disk_cache=/tmp/bazel_cache']
+
+
+def bazel_record(repo: str, command: str, case: Case, targets: list[str],
+                 tree: str, success: bool):
+    """
+    Records the result of a bazel command in the result ledger.
+    """
+
+    results_record(
+        repo,
+        bazel_key(command, case, targets, tree),
+        success,
+        tree=tree,
+        command=command,
+        target=case.target,
+        product=case.product,
+        flags=case.flags,
+    )
+
+
+@traced
+def bazel_run(repo: str, command: str, case: Case, targets: list[str],
+              tree: str | None, remote_cache: str | None) -> bool:
+    """
+    Runs a bazel command for the targets and records the result in the result
+    ledger if the tree is known. The build events of the run are written to
+    the file at bep_path and a profile is captured for the commit and case.
+    """
+
+    bep_clear(repo)
+
+    commit = git_parse_rev(repo, 'HEAD')
+    profile = profile_flags(profile_dir(repo, commit, case.target))
+    start = time.monotonic()
+
+    success = subprocess.run(
+        [
+            'bazel',
+            command,
+            *targets,
+            '--define=ij_product=%s' % case.product,
+            *cache_flags(remote_cache),
+            '--build_event_json_file=%s' % bep_path(repo),
+            *profile,
+            *case.flags,
+        ],
+        cwd=repo,
+        stderr=sys.stdout,
+        stdout=sys.stdout,
+    ).returncode == 0
+
+    wall = time.monotonic() - start
+
+    ledger_case(command, case.target, commit, success, False, wall)
+    key = profile_key(command, case.target, case.product, case.flags, targets)
+    profile_report(repo, commit, case.target, key, wall)
+
+    stats = bep_cache_stats(bep_path(repo))
+    if stats is not None and stats[1] > 0:
+        log('cache hits: %d of %d actions (%.0f%%)' % (
+            stats[0], stats[1], 100 * stats[0] / stats[1]
+        ))
+
+    if tree is not None:
+        bazel_record(repo, command, case, targets, tree, success)
+
+    return success
+
+
+def bazel_cached(repo: str, command: str, case: Case, targets: list[str],
+                 cache: bool) -> (str | None, bool | None):
+    """
+    Looks up the previous result of the bazel command for the current tree.
+    Returns the tree if results can be cached and the cached result if there
+    is one.
+    """
+
+    tree = clean_tree(repo) if cache else None
+    if tree is None:
+        return (None, None)
+
+    key = bazel_key(command, case, targets, tree)
+    cached = results_lookup(repo, key)
+
+    if cached is not None:
+        commit = git_parse_rev(repo, 'HEAD')
+        ledger_case(command, case.target, commit, cached, True, 0)
+
+    return (tree, cached)
+
+
+def format_failed(failed: list[tuple[str, list[str]]]) -> str:
+    lines = []
+
+    for label, logs in failed:
+        lines.append('  %s' % label)
+        lines.extend('    %s' % it for it in logs)
+
+    return '\n'.join(lines)
+
+
+@traced
+def bazel_test(repo: str, case: Case, targets: list[str] | None = None,
+               cache: bool = True, remote_cache: str | None = None):
+    """
+    Runs a bazel test command for the given target and ij_product. If targets
+    are specified, they are tested instead of the case target. Returns
+    immediately if the tests already passed on the same tree.
+
+    If the tests fail, the failed targets are read from the build event
+    protocol file and can be retried on their own.
+    """
+
+    if targets is None:
+        targets = [case.target]
+
+    tree, cached = bazel_cached(repo, 'test', case, targets, cache)
+
+    if cached:
+        log('test %s passed (cached)' % case.target)
+        return
+
+    retry_case, retry_targets = case, targets
+
+    # tree of the last run of all targets, a passing retry of the failed
+    # targets only completes that run if the tree did not change since
+    full_tree = None
+
+    while True:
+        if cached is False:
+            log('test %s failed on this tree before' % case.target)
+            success, cached = False, None
+            failed = []
+        else:
+            # the working tree can be changed before a retry, the result is
+            # only recorded for the tree that is actually tested
+            tree = clean_tree(repo) if cache else None
+
+            log('executing test %s (%d targets)' % (
+                case.target, len(retry_targets)
+            ))
+            success = bazel_run(
+                repo, 'test', retry_case, retry_targets, tree, remote_cache
+            )
+            failed = bep_failed_tests(bep_path(repo))
+
+            if retry_targets is targets:
+                full_tree = tree
 
         if success:
+            # the other targets already passed in the run of all targets
+            if retry_targets is not targets and tree is not None and \
+                    tree == full_tree:
+                bazel_record(repo, 'test', case, targets, tree, True)
+
             log('test %s passed' % case.target)
             break
 
+        options = ['[r] retry all']
+        if len(failed) > 0:
+            options += [
+                '[f] retry failed',
+                '[s] retry failed, %d runs each' % RUNS_PER_TEST,
+            ]
+
+        title = 'test %s failed, press enter to retry' % case.target
+        if len(failed) > 0:
+            title += '\n' + format_failed(failed)
+
         result = choose(
-            title='test %s failed, press enter to retry' % case.target,
-            options=[
-                '[r] retry',
-                '[a] abort',
-            ],
+            title=title,
+            options=options + ['[a] abort'],
         )
 
         if result == "a":
             exit("test aborted")
 
+        if result == 'r':
+            retry_case, retry_targets = case, targets
+        if result == 'f':
+            retry_case = case
+            retry_targets = [label for label, _ in failed]
+        if result == 's':
+            retry_case = dataclasses.replace(
+                case,
+                flags=[*case.flags, '--runs_per_test=%d' % RUNS_PER_TEST],
+            )
+            retry_targets = [label for label, _ in failed]
+
+
+@traced
+def bazel_build(repo: str, case: Case, cache: bool = True,
+                remote_cache: str | None = None):
+    tree, cached = bazel_cached(repo, 'build', case, [case.target], cache)
+
+    if cached:
+        log('build %s passed (cached)' % case.target)
+        return
 
-def bazel_build(repo: str, case: Case):
     while True:
-        log('executing build %s' % case.target)
-
-        success = subprocess.run(
-            [
-                'bazel',
-                'build',
-                case.target,
-                '--define=ij_product=%s' % case.product,
-                '--disk_cache=/tmp/bazel_cache',
-                *case.flags,
-            ],
-            cwd=repo,
-            stderr=sys.stdout,
-            stdout=sys.stdout,
-        ).returncode == 0
+        if cached is False:
+            log('build %s failed on this tree before' % case.target)
+            success, cached = False, None
+        else:
+            # the working tree can be changed before a retry, the result is
+            # only recorded for the tree that is actually tested
+            tree = clean_tree(repo) if cache else None
+
+            log('executing build %s' % case.target)
+            success = bazel_run(
+                repo, 'build', case, [case.target], tree, remote_cache
+            )
 
         if success:
             log('build %s passed' % case.target)
@@ -110,6 +555,56 @@ def bazel_build(repo: str, case: Case):
             exit("test aborted")
 
 
+@traced
+def run_cases(repo: str, runs: list[tuple[str, Case, list[str]]],
+              cache: bool = True, remote_cache: str | None = None) -> bool:
+    """
+    Runs the bazel commands once, without asking to retry failures, and stops
+    at the first failure. Results cached for the tree are reused. Returns true
+    if all of them passed.
+    """
+
+    for command, case, targets in runs:
+        tree, cached = bazel_cached(repo, command, case, targets, cache)
+
+        if cached is None:
+            log('executing %s %s' % (command, case.target))
+            cached = bazel_run(
+                repo, command, case, targets, tree, remote_cache
+            )
+        elif cached:
+            log('%s %s passed (cached)' % (command, case.target))
+
+        if not cached:
+            log('%s %s failed' % (command, case.target))
+            return False
+
+    return True
+
+
+def run_suite(repo: str, args: argparse.Namespace) -> bool:
+    """
+    Runs the builds or tests selected by the arguments once, see run_cases.
+    """
+
+    if args.buildonly:
+        runs = [('build', case, [case.target]) for case in BUILD_CASES]
+    else:
+        packages = None if args.full else changed_packages(repo)
+        runs = []
+
+        for case in TEST_CASES:
+            if packages is None:
+                runs.append(('test', case, [case.target]))
+                continue
+
+            targets = affected_targets(repo, case, packages)
+            if len(targets) > 0:
+                runs.append(('test', case, targets))
+
+    return run_cases(repo, runs, not args.nocache, args.remote_cache)
+
+
 def configure(parser: argparse.ArgumentParser):
     parser.add_argument(
         '--buildonly',
@@ -117,15 +612,58 @@ def configure(parser: argparse.ArgumentParser):
         help='run build the targets',
         default=False,
     )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='run all tests instead of only the affected ones',
+        default=False,
+    )
+    parser.add_argument(
+        '--nocache',
+        action='store_true',
+        help='ignore cached results from previous runs',
+        default=False,
+    )
+    parser.add_argument(
+        '--remote_cache',
+        type=str,
+        help='url of a bazel remote cache, replaces the local disk cache '
+             '(env: AOSP_REMOTE_CACHE)',
+        default=os.environ.get('AOSP_REMOTE_CACHE'),
+    )
 
 
+@traced
 def execute(args: argparse.Namespace):
     if (args.buildonly):
         for case in BUILD_CASES:
-            bazel_build(args.repo, case)
+            bazel_build(
+                args.repo,
+                case,
+                cache=not args.nocache,
+                remote_cache=args.remote_cache,
+            )
         log('all builds passed')
 
     else:
+        packages = None if args.full else changed_packages(args.repo)
+
         for case in TEST_CASES:
-            bazel_test(args.repo, case)
+            targets = None
+
+            if packages is not None:
+                targets = affected_targets(args.repo, case, packages)
+
+                if len(targets) == 0:
+                    log('no affected tests in %s' % case.target)
+                    continue
+
+            bazel_test(
+                args.repo,
+                case,
+                targets,
+                cache=not args.nocache,
+                remote_cache=args.remote_cache,
+            )
+
         log('all tests passed')
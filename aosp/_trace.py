@@ -0,0 +1,145 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import subprocess
+import threading
+import time
+
+from ._util import log
+
+# number of stages printed in the summary
+SUMMARY_SIZE = 10
+
+# the recorded trace events, None if tracing is disabled
+EVENTS: list[dict] | None = None
+
+
+def now() -> float:
+    """
+    Gets the current time in microseconds.
+    """
+
+    return time.perf_counter_ns() / 1000
+
+
+def trace_event(name: str, category: str, start: float, **args):
+    EVENTS.append({
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': start,
+        'dur': now() - start,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args,
+    })
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = 'aosp', **args):
+    """
+    Records a timed span around the body if tracing is enabled.
+    """
+
+    if EVENTS is None:
+        yield
+        return
+
+    start = now()
+    try:
+        yield
+    except BaseException as e:
+        args['error'] = type(e).__name__
+        raise
+    finally:
+        trace_event(name, category, start, **args)
+
+
+def traced(func):
+    """
+    Decorator that records a span for every call of the function. The module
+    of the function is used as category.
+    """
+
+    category = func.__module__.rsplit('.', 1)[-1].lstrip('_')
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__, category):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class TracedPopen(subprocess.Popen):
+    """
+    Popen that records a span from spawning the process until it is waited
+    for, including the argv and the exit code.
+    """
+
+    def __init__(self, args, *rest, **kwargs):
+        self.trace_start = now()
+        self.trace_done = False
+        super().__init__(args, *rest, **kwargs)
+
+    def wait(self, timeout=None):
+        code = super().wait(timeout)
+
+        if not self.trace_done:
+            self.trace_done = True
+
+            argv = [self.args] if isinstance(self.args, str) else self.args
+            trace_event(
+                ' '.join(str(it) for it in argv[:2]),
+                'subprocess',
+                self.trace_start,
+                argv=[str(it) for it in argv],
+                exit=code,
+            )
+
+        return code
+
+
+def trace_summary() -> list[str]:
+    """
+    Aggregates the spans by name and formats the slowest ones.
+    """
+
+    stages = {}
+    for event in EVENTS:
+        key = (event['cat'], event['name'])
+        count, total = stages.get(key, (0, 0))
+        stages[key] = (count + 1, total + event['dur'])
+
+    slowest = sorted(stages.items(), key=lambda it: it[1][1], reverse=True)
+
+    return [
+        '%10.3fs %4dx %s: %s' % (total / 1e6, count, category, name)
+        for (category, name), (count, total) in slowest[:SUMMARY_SIZE]
+    ]
+
+
+def trace_write(path: str):
+    with open(path, 'wt') as f:
+        json.dump({'traceEvents': EVENTS}, f)
+
+    log('trace written to %s, slowest stages:' % path)
+
+    for line in trace_summary():
+        print(line)
+
+
+def trace_enable(path: str):
+    """
+    Enables tracing for the rest of the process. All subprocesses are recorded
+    and the trace is written as chrome trace event json when the process
+    exits.
+    """
+
+    global EVENTS
+    EVENTS = []
+
+    subprocess.Popen = TracedPopen
+    atexit.register(trace_write, path)
@@ -1,7 +1,7 @@
+import json
+import os
 import sys
 
-from simple_term_menu import TerminalMenu
-
 
 def log(message: str):
     print('>> ' + message)
@@ -28,6 +28,9 @@ def ask(question: str) -> bool:
 
 
 def choose(title: str, options: list[str]) -> str:
+    # imported lazily, the menu is only needed by interactive commands
+    from simple_term_menu import TerminalMenu
+
     menu = TerminalMenu(options, title='?? ' + title)
     index = menu.show()
 
@@ -44,3 +47,30 @@ def filter_none(generator):
 
 def first(generator):
     return next(iter(generator), None)
+
+
+def read_json(path: str, default):
+    """
+    Reads a json file or returns the default if the file does not exist or
+    cannot be parsed.
+    """
+
+    try:
+        with open(path, 'rt') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path: str, data):
+    """
+    Writes the data to a json file. The file is replaced atomically to not
+    corrupt it if the tool is interrupted.
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + '.tmp', 'wt') as f:
+        json.dump(data, f, indent=2)
+
+    os.replace(path + '.tmp', path)
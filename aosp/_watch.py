@@ -0,0 +1,237 @@
+import argparse
+import os
+import subprocess
+import time
+import traceback
+
+from ._consts import AOSP_REF, INTELLIJ_REF
+from ._git import (
+    git_setup_aosp,
+    git_setup_intellij,
+    git_parse_rev,
+    git_log,
+    git_try_read_aosp_commit,
+    git_cache_dir,
+)
+from ._missing import stream_missing_commits
+from ._patch import (
+    patch_generate,
+    patch_apply_in_memory,
+    patch_cache_store,
+    patch_cache_load,
+)
+from ._review import generate_stat
+from ._trace import traced
+from ._util import log, read_json, write_json
+
+WATCH_FILE = 'watch.json'
+
+# default poll interval in seconds
+INTERVAL = 5 * 60
+
+
+def watch_path(repo: str) -> str:
+    return os.path.join(git_cache_dir(repo), WATCH_FILE)
+
+
+@traced
+def precompute(repo: str, commit: str, base: str) -> dict:
+    """
+    Generates and caches the patch for the aosp commit and checks if it
+    applies to the base. For a clean patch the drift between the picked and
+    the aosp commit is computed as well.
+    """
+
+    patch = patch_generate(repo, commit)
+    patch_cache_store(repo, commit, patch)
+
+    return check(repo, commit, base, patch)
+
+
+def try_precompute(repo: str, commit: str, base: str,
+                   patch: str | None = None) -> dict:
+    """
+    Precomputes the commit or only checks the patch if it is cached. Errors
+    are logged and recorded in the entry. The entry of a failed commit has no
+    base, it is retried with every recheck of the pending commits.
+    """
+
+    try:
+        if patch is None:
+            return precompute(repo, commit, base)
+        else:
+            return check(repo, commit, base, patch)
+
+    # patch_generate exits through log_error on malformed commits
+    except (Exception, SystemExit) as e:
+        if not isinstance(e, SystemExit):
+            traceback.print_exc()
+
+        log('precomputing %s failed' % commit)
+
+        return {
+            'subject': None,
+            'base': None,
+            'applies': False,
+            'conflicts': [],
+            'stat': None,
+            'error': repr(e),
+        }
+
+
+def check(repo: str, commit: str, base: str, patch: str) -> dict:
+    pick, conflicts = patch_apply_in_memory(repo, patch, base)
+
+    if pick is None:
+        stat = None
+    else:
+        stat = generate_stat(repo, pick, commit)
+
+    return {
+        'subject': git_log(repo, commit, '%s'),
+        'base': base,
+        'applies': pick is not None,
+        'conflicts': conflicts,
+        'stat': stat,
+    }
+
+
+@traced
+def picked_since(repo: str, bases: set[str], base: str) -> set[str]:
+    """
+    Collects the aosp commits picked to the intellij branch between the old
+    bases and the current base.
+    """
+
+    if len(bases) == 0:
+        return set()
+
+    output = subprocess.check_output(
+        ['git', 'rev-list', '--ignore-missing', base, '--not', *bases],
+        cwd=repo,
+    )
+
+    picked = (
+        git_try_read_aosp_commit(repo, it) for it in output.decode().split()
+    )
+    return set(it for it in picked if it is not None)
+
+
+@traced
+def poll(repo: str, state: dict):
+    """
+    Fetches both remotes, precomputes the patches of all new aosp commits and
+    rechecks pending commits if the intellij branch moved.
+    """
+
+    git_setup_aosp(repo)
+    git_setup_intellij(repo)
+
+    tip = git_parse_rev(repo, AOSP_REF)
+    base = git_parse_rev(repo, INTELLIJ_REF)
+
+    if state['tip'] is None:
+        state['tip'] = tip
+
+    for commit in stream_missing_commits(repo, state['tip'], tip):
+        log('precomputing %s' % commit)
+        state['commits'][commit] = try_precompute(repo, commit, base)
+
+    state['tip'] = tip
+
+    # commits picked since the last check are done and no longer tracked
+    bases = set(
+        entry['base'] for entry in state['commits'].values()
+        if entry['base'] not in [None, base]
+    )
+    for commit in picked_since(repo, bases, base) & state['commits'].keys():
+        log('%s was picked' % commit)
+        del state['commits'][commit]
+
+    # the applicability changes with the intellij branch, the patch does not
+    for commit, entry in state['commits'].items():
+        if entry['base'] == base:
+            continue
+
+        log('rechecking %s' % commit)
+        patch = patch_cache_load(repo, commit)
+
+        state['commits'][commit] = try_precompute(repo, commit, base, patch)
+
+
+def format_entry(commit: str, entry: dict) -> str:
+    if 'error' in entry:
+        return '%s %-28s %s' % (commit[:12], 'failed', entry['error'])
+
+    if entry['applies']:
+        status = 'clean (%d (+), %d (-))' % tuple(entry['stat'] or (0, 0))
+    else:
+        status = 'conflicts in %d files' % len(entry['conflicts'])
+
+    return '%s %-28s %s' % (commit[:12], status, entry['subject'])
+
+
+def configure(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        '--since',
+        type=str,
+        help='precompute all commits after this aosp commit, defaults to the '
+             'aosp tip of the first poll',
+    )
+    parser.add_argument(
+        '--interval',
+        type=int,
+        help='poll interval in seconds',
+        default=INTERVAL,
+    )
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='poll only once and exit',
+        default=False,
+    )
+    parser.add_argument(
+        '--status',
+        action='store_true',
+        help='only print the precomputed commits',
+        default=False,
+    )
+
+
+def execute(args: argparse.Namespace):
+    repo = args.repo
+    path = watch_path(repo)
+
+    state = read_json(path, {'tip': None, 'commits': {}})
+
+    if args.status:
+        for commit, entry in state['commits'].items():
+            print(format_entry(commit, entry))
+        log('%d precomputed commits' % len(state['commits']))
+        return
+
+    if args.since is not None:
+        state['tip'] = args.since
+
+    while True:
+        # a failing poll, e.g. an unreachable remote, is retried after the
+        # interval, the commits precomputed so far are kept
+        try:
+            poll(repo, state)
+        except (Exception, SystemExit) as e:
+            if args.once:
+                raise
+
+            if not isinstance(e, SystemExit):
+                traceback.print_exc()
+
+            log('poll failed, retrying in %ds' % args.interval)
+
+        write_json(path, state)
+
+        log('%d precomputed commits' % len(state['commits']))
+
+        if args.once:
+            break
+
+        time.sleep(args.interval)
@@ -0,0 +1,402 @@
+import argparse
+import contextlib
+import dataclasses
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from aosp import _deaosp, _patch, _review, _missing, _odb
+from aosp._consts import AOSP_REF, INTELLIJ_REF
+
+from ._repo import Params, Fixture, generate, git
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# medians that are slower than the baseline by this factor are reported
+REGRESSION_FACTOR = 1.1
+
+
+@dataclasses.dataclass
+class Benchmark:
+    name: str
+    run: callable
+    # called before every run, the result is passed to run
+    setup: callable = lambda: None
+
+
+def native(run: callable) -> callable:
+    """
+    Runs the benchmark with the native git object reader enabled.
+    """
+
+    def wrapper(value):
+        _odb.ENABLED = True
+        try:
+            return run(value)
+        finally:
+            _odb.ENABLED = False
+
+    return wrapper
+
+
+def hot_benchmarks(fixture: Fixture) -> list[Benchmark]:
+    """
+    Benchmarks for the hot functions of the tool, executed in process.
+    """
+
+    repo = fixture.repo
+    commit, aosp_commit = fixture.picks[-1]
+
+    diff = git(repo, 'diff', '%s~1' % fixture.large, fixture.large)
+    lines = diff.splitlines(keepends=True)
+
+    pending = list(
+        _missing.stream_missing_commits(repo, fixture.base, AOSP_REF)
+    )[:50]
+
+    return [
+        Benchmark(
+            name='deaosp.process',
+            run=lambda _: [_deaosp.process(it) for it in lines],
+        ),
+        Benchmark(
+            name='patch.patch_generate_diff',
+            run=lambda _: _patch.patch_generate_diff(repo, fixture.large),
+        ),
+        Benchmark(
+            name='patch.patch_process',
+            setup=lambda: _patch.patch_generate_diff(repo, fixture.large),
+            run=_patch.patch_process,
+        ),
+        Benchmark(
+            name='patch.patch_generate',
+            run=lambda _: _patch.patch_generate(repo, fixture.next),
+        ),
+        Benchmark(
+            name='review.generate_stat',
+            run=lambda _: _review.generate_stat(repo, commit, aosp_commit),
+        ),
+        Benchmark(
+            name='missing.stream_missing_commits',
+            run=lambda _: list(
+                _missing.stream_missing_commits(repo, fixture.base, AOSP_REF)
+            ),
+        ),
+        Benchmark(
+            name='missing.format_commit x%d' % len(pending),
+            run=lambda _: [_missing.format_commit(repo, it) for it in pending],
+        ),
+        Benchmark(
+            name='missing.format_commit x%d native' % len(pending),
+            run=native(
+                lambda _: [_missing.format_commit(repo, it) for it in pending]
+            ),
+        ),
+    ]
+
+
+def cli(repo: str, *args: str):
+    """
+    Runs the tool in a new process against the current sources.
+    """
+
+    env = dict(os.environ, PYTHONPATH=ROOT, REPO=repo)
+
+    subprocess.check_call(
+        [sys.executable, '-c', 'import aosp; aosp.main()', *args],
+        env=env,
+        cwd=repo,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def cli_benchmarks(fixture: Fixture, dir: str) -> list[Benchmark]:
+    """
+    Benchmarks for the subcommands, executed end to end in a new process.
+    """
+
+    repo = fixture.repo
+    commit, _ = fixture.picks[-1]
+    head = git(repo, 'rev-parse', INTELLIJ_REF)
+
+    sources = os.path.join(dir, 'sources')
+    if not os.path.isdir(sources):
+        os.makedirs(sources)
+        archive = subprocess.Popen(
+            ['git', 'archive', fixture.large, 'aswb'],
+            cwd=repo,
+            stdout=subprocess.PIPE,
+        )
+        subprocess.check_call(['tar', '-x'], cwd=sources, stdin=archive.stdout)
+        archive.wait()
+
+    def reset():
+        git(repo, 'reset', '--quiet', '--hard', head)
+
+    def copy_sources() -> str:
+        target = os.path.join(dir, 'remap')
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(sources, target)
+        return target
+
+    return [
+        Benchmark(
+            name='cli --version',
+            run=lambda _: cli(repo, '--version'),
+        ),
+        Benchmark(
+            name='cli missing',
+            run=lambda _: cli(
+                repo,
+                'missing',
+                '--offline',
+                '--rebuild',
+                fixture.base,
+                '-o',
+                os.path.join(dir, 'missing.csv'),
+            ),
+        ),
+        Benchmark(
+            name='cli --native-git missing',
+            run=lambda _: cli(
+                repo,
+                '--native-git',
+                'missing',
+                '--offline',
+                '--rebuild',
+                fixture.base,
+                '-o',
+                os.path.join(dir, 'missing.csv'),
+            ),
+        ),
+        Benchmark(
+            name='cli missing, no new commits',
+            run=lambda _: cli(
+                repo,
+                'missing',
+                '--offline',
+                fixture.base,
+                '-o',
+                os.path.join(dir, 'missing.csv'),
+            ),
+        ),
+        Benchmark(
+            name='cli review --mode stat',
+            run=lambda _: cli(repo, 'review', '--commit', commit, '--mode',
+                              'stat'),
+        ),
+        Benchmark(
+            name='cli remap',
+            setup=copy_sources,
+            run=lambda target: cli(repo, 'remap', target),
+        ),
+        Benchmark(
+            name='cli patch',
+            setup=reset,
+            run=lambda _: cli(repo, 'patch', fixture.next),
+        ),
+    ]
+
+
+def measure(benchmark: Benchmark, repeat: int) -> dict:
+    runs = []
+
+    for _ in range(repeat):
+        with (
+            open(os.devnull, 'wt') as devnull,
+            contextlib.redirect_stdout(devnull),
+        ):
+            value = benchmark.setup()
+
+            start = time.perf_counter()
+            benchmark.run(value)
+            runs.append(time.perf_counter() - start)
+
+    return {
+        'runs': runs,
+        'min': min(runs),
+        'median': statistics.median(runs),
+    }
+
+
+def load_fixture(dir: str, params: Params) -> Fixture:
+    """
+    Reuses the synthetic repository in the directory if it was generated with
+    the same parameters, otherwise generates it.
+    """
+
+    path = os.path.join(dir, 'fixture.json')
+
+    try:
+        with open(path, 'rt') as f:
+            data = json.load(f)
+
+        if data['params'] == dataclasses.asdict(params):
+            return Fixture(**data['fixture'])
+
+    except (OSError, ValueError, KeyError):
+        pass
+
+    shutil.rmtree(dir, ignore_errors=True)
+    os.makedirs(dir)
+
+    print('>> generating synthetic repository in %s' % dir)
+    fixture = generate(dir, params)
+
+    with open(path, 'wt') as f:
+        json.dump({
+            'params': dataclasses.asdict(params),
+            'fixture': dataclasses.asdict(fixture),
+        }, f)
+
+    return fixture
+
+
+def revision() -> str | None:
+    try:
+        return git(ROOT, 'rev-parse', 'HEAD')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, path: str):
+    """
+    Prints the medians of the results next to the medians of a previous run.
+    """
+
+    with open(path, 'rt') as f:
+        baseline = json.load(f)
+
+    if baseline['fixture'] != results['fixture']:
+        print('!! baseline was measured on a different synthetic repository')
+
+    print('%-40s %10s %10s %8s' % ('benchmark', 'baseline', 'current', ''))
+
+    for name, result in results['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+
+        ratio = result['median'] / old['median']
+        print('%-40s %9.3fs %9.3fs %7.2fx%s' % (
+            name,
+            old['median'],
+            result['median'],
+            ratio,
+            ' slower' if ratio > REGRESSION_FACTOR else '',
+        ))
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='benchmarks the tool on a synthetic aosp repository',
+    )
+
+    parser.add_argument(
+        '--work',
+        type=str,
+        help='directory for the synthetic repository, reused between runs',
+    )
+    parser.add_argument(
+        '--commits',
+        type=int,
+        help='number of commits on the aosp branch',
+        default=Params.commits,
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        help='number of runs per benchmark',
+        default=5,
+    )
+    parser.add_argument(
+        '--filter',
+        type=str,
+        help='only run benchmarks containing this string',
+        default='',
+    )
+    parser.add_argument(
+        '-o',
+        type=str,
+        help='path to the output json file',
+        dest='output',
+        default='bench.json',
+    )
+    parser.add_argument(
+        '--compare',
+        type=str,
+        help='path to the json file of a previous run to compare against',
+    )
+
+    args = parser.parse_args()
+
+    # the picked and the pending commits are taken from the end of the aosp
+    # branch, after at least one commit of the initial history
+    minimum = Params.picks + Params.pending + 1
+    if args.commits < minimum:
+        parser.error('--commits must be at least %d' % minimum)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+    params = Params(commits=args.commits)
+
+    if args.work is None:
+        dir = tempfile.mkdtemp(prefix='aosp-bench-')
+    else:
+        dir = os.path.abspath(args.work)
+
+    try:
+        fixture = load_fixture(dir, params)
+
+        benchmarks = hot_benchmarks(fixture) + cli_benchmarks(fixture, dir)
+        results = {}
+
+        for benchmark in benchmarks:
+            if args.filter not in benchmark.name:
+                continue
+
+            result = measure(benchmark, args.repeat)
+            results[benchmark.name] = result
+
+            print('%-40s %9.3fs (min %.3fs)' % (
+                benchmark.name, result['median'], result['min']
+            ))
+
+        results = {
+            'revision': revision(),
+            'python': platform.python_version(),
+            'git': git(ROOT, '--version'),
+            'params': dataclasses.asdict(params),
+            'fixture': {
+                'base': fixture.base,
+                'next': fixture.next,
+                'intellij': git(fixture.repo, 'rev-parse', INTELLIJ_REF),
+            },
+            'results': results,
+        }
+
+    finally:
+        if args.work is None:
+            shutil.rmtree(dir, ignore_errors=True)
+
+    with open(args.output, 'wt') as f:
+        json.dump(results, f, indent=2)
+
+    print('>> results written to %s' % args.output)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+import dataclasses
+import os
+import random
+import subprocess
+
+from aosp._consts import (
+    AOSP_REMOTE,
+    AOSP_BRANCH,
+    AOSP_ORIGIN,
+    INTELLIJ_REMOTE,
+    INTELLIJ_BRANCH,
+    INTELLIJ_ORIGIN,
+)
+from aosp._deaosp import process
+from aosp._patch import IGNORED_DIRECTORIES
+
+# labels used in the generated BUILD files, kept fixed so that the synthetic
+# repository does not change between revisions of the tool
+LABELS = [
+    '//tools/adt/idea/aswb/base:base',
+    '//tools/adt/idea/aswb/common/experiments:experiments',
+    '//tools/vendor/google/aswb/plugin_api:plugin_api',
+    '//third_party/intellij/bazel/plugin/sdkcompat:sdkcompat',
+    '//third_party/intellij/plugin/shared:shared',
+    '//tools/vendor/google3/aswb/third_party/java:guava',
+    '//third_party/java/auto:auto_value',
+    '//third_party/java/junit',
+    '//third_party/java/truth',
+    '//plugin_api:plugin_api_for_tests',
+    '//plugin_api:jsr305',
+    '//plugin_api:test_libs',
+    '//plugin_api',
+    '@maven//:com.google.guava.guava',
+    '@maven//:com.google.protobuf.protobuf-java',
+    '@maven//:com.google.code.gson.gson',
+    '//prebuilts/tools/common/m2:jsr305-2.0.1',
+    '//testing:lib',
+    '//proto:proto',
+    ':srcs',
+]
+
+# directories of the aswb subtree that are ignored by the tool
+IGNORED = ['aswb', 'ijwb', 'java', 'kotlin']
+
+AUTHOR = 'Googler <googler@google.com>'
+EPOCH = 1700000000
+
+
+@dataclasses.dataclass
+class Params:
+    # total number of commits on the aosp branch
+    commits: int = 3000
+    # number of aosp commits already picked to the intellij branch
+    picks: int = 50
+    # number of aosp commits that are not picked yet
+    pending: int = 200
+    # number of packages in the aswb subtree
+    packages: int = 120
+    # size of the binary files, changed every BINARY_INTERVAL commits
+    binary_size: int = 1 << 20
+    seed: int = 42
+
+
+@dataclasses.dataclass
+class Fixture:
+    repo: str
+    # last aosp commit picked to the intellij branch
+    base: str
+    # picked commits as (intellij commit, aosp commit)
+    picks: list[tuple[str, str]]
+    # the next aosp commit to pick, applies cleanly
+    next: str
+    # the aosp commit with the largest diff
+    large: str
+
+
+BINARY_INTERVAL = 100
+
+
+class Generator:
+    """
+    Generates the history of an AOSP-shaped repository. Text files are stored
+    as list of lines, binary files as bytes.
+    """
+
+    def __init__(self, params: Params):
+        self.params = params
+        self.rng = random.Random(params.seed)
+        self.files = {}
+
+    def build_file(self) -> list[str]:
+        rng = self.rng
+        lines = ['load("//build_defs:build_defs.bzl", "aswb_library")', '']
+
+        for i in range(rng.randint(3, 8)):
+            lines += [
+                'aswb_library(',
+                '    name = "lib%d",' % i,
+                '    srcs = glob(["src/lib%d/**/*.java"]),' % i,
+                '    deps = [',
+            ]
+            lines += [
+                '        "%s",' % rng.choice(LABELS)
+                for _ in range(rng.randint(5, 20))
+            ]
+            lines += ['    ],', ')', '']
+
+        return lines
+
+    def java_file(self, name: str) -> list[str]:
+        rng = self.rng
+        lines = ['package com.google.idea.%s;' % name, '', 'class Main {']
+        lines += [
+            '    int field%d = %d;' % (i, rng.randint(0, 1 << 16))
+            for i in range(rng.randint(40, 150))
+        ]
+        lines += ['}']
+
+        return lines
+
+    def binary_file(self) -> bytes:
+        return self.rng.randbytes(self.params.binary_size)
+
+    def package(self, i: int) -> str:
+        # a few packages live in directories that are ignored by the tool
+        if i % 20 == 0:
+            return 'aswb/%s/pkg%d' % (IGNORED[i // 20 % 4], i)
+
+        return 'aswb/pkg%d' % i
+
+    def initial(self) -> dict:
+        for i in range(self.params.packages):
+            package = self.package(i)
+
+            self.files['%s/BUILD' % package] = self.build_file()
+            for j in range(5):
+                path = '%s/src/lib%d/File%d.java' % (package, j, j)
+                self.files[path] = self.java_file('pkg%d' % i)
+
+            if i % 10 == 0:
+                self.files['%s/testdata/blob.bin' % package] = \
+                    self.binary_file()
+
+        for i in range(self.params.packages // 4):
+            self.files['studio/mod%d/Main.java' % i] = self.java_file('mod')
+
+        return dict(self.files)
+
+    def edit_lines(self, lines: list[str]) -> list[str]:
+        rng = self.rng
+        lines = list(lines)
+
+        for _ in range(rng.randint(1, 4)):
+            i = rng.randrange(len(lines))
+
+            if lines[i].startswith('        "'):
+                lines[i] = '        "%s",' % rng.choice(LABELS)
+            elif lines[i].startswith('    int '):
+                lines[i] = lines[i].rsplit('=', 1)[0] + '= %d;' % (
+                    rng.randint(0, 1 << 16)
+                )
+            else:
+                lines.insert(i + 1, '    // change %d' % rng.randint(0, 999))
+
+        return lines
+
+    def change(self, index: int, large: bool, text_only: bool) -> dict:
+        """
+        Generates the changes of one commit, maps the path to the new content.
+        """
+
+        rng = self.rng
+        paths = sorted(self.files.keys())
+        changes = {}
+
+        if large:
+            selected = [it for it in paths if it.endswith('/BUILD')]
+        elif text_only:
+            sources = [
+                it for it in paths
+                if it.startswith('aswb/pkg') and it.endswith('.java')
+            ]
+            selected = rng.sample(sources, rng.randint(1, 4))
+        else:
+            selected = rng.sample(paths, rng.randint(1, 4))
+
+        for path in selected:
+            content = self.files[path]
+
+            if isinstance(content, bytes):
+                if not text_only:
+                    changes[path] = self.binary_file()
+            else:
+                changes[path] = self.edit_lines(content)
+
+        if not text_only and (large or index % BINARY_INTERVAL == 0):
+            blobs = [it for it in paths if it.endswith('.bin')]
+            changes[rng.choice(blobs)] = self.binary_file()
+
+        self.files.update(changes)
+        return changes
+
+
+def encode(content: list[str] | bytes) -> bytes:
+    if isinstance(content, bytes):
+        return content
+
+    return ('\n'.join(content) + '\n').encode()
+
+
+def fast_import(repo: str, commits: list) -> list[str]:
+    """
+    Writes the commits with git fast-import to refs/heads/main of the
+    repository and returns the commit hashes. A commit is a tuple of the
+    message and the changes, a change of None deletes the file.
+    """
+
+    marks = os.path.join(repo, 'marks')
+
+    importer = subprocess.Popen(
+        ['git', 'fast-import', '--quiet', '--export-marks=%s' % marks],
+        cwd=repo,
+        stdin=subprocess.PIPE,
+    )
+
+    def data(value: bytes):
+        importer.stdin.write(b'data %d\n' % len(value))
+        importer.stdin.write(value)
+        importer.stdin.write(b'\n')
+
+    for i, (message, changes) in enumerate(commits):
+        importer.stdin.write(b'commit refs/heads/main\n')
+        importer.stdin.write(b'mark :%d\n' % (i + 1))
+        importer.stdin.write(b'author %s %d +0000\n' % (
+            AUTHOR.encode(), EPOCH + i * 3600
+        ))
+        importer.stdin.write(b'committer %s %d +0000\n' % (
+            AUTHOR.encode(), EPOCH + i * 3600
+        ))
+        data(message.encode())
+
+        if i > 0:
+            importer.stdin.write(b'from :%d\n' % i)
+
+        for path, content in sorted(changes.items()):
+            if content is None:
+                importer.stdin.write(b'D %s\n' % path.encode())
+            else:
+                importer.stdin.write(b'M 100644 inline %s\n' % path.encode())
+                data(encode(content))
+
+    importer.stdin.close()
+
+    if importer.wait() != 0:
+        raise RuntimeError('git fast-import failed')
+
+    with open(marks, 'rt') as f:
+        hashes = dict(line.split() for line in f)
+
+    return [hashes[':%d' % (i + 1)] for i in range(len(commits))]
+
+
+def remap(changes: dict) -> dict:
+    """
+    Remaps aosp changes the same way a pick does: only files from aswb are
+    kept, the prefix is stripped and all labels are remapped.
+    """
+
+    result = {}
+
+    for path, content in changes.items():
+        if not path.startswith('aswb/'):
+            continue
+        if any(path.startswith('aswb/%s' % it) for it in IGNORED_DIRECTORIES):
+            continue
+
+        if content is not None and not isinstance(content, bytes):
+            content = [process(line) for line in content]
+
+        result[path.removeprefix('aswb/')] = content
+
+    return result
+
+
+def git(repo: str, *args: str) -> str:
+    return subprocess.check_output(['git', *args], cwd=repo).decode().strip()
+
+
+def git_init(path: str, bare: bool):
+    os.makedirs(path)
+    subprocess.check_call(
+        ['git', 'init', '--quiet', *(['--bare'] if bare else []), path],
+    )
+
+
+def generate(dir: str, params: Params) -> Fixture:
+    """
+    Generates the synthetic repositories in the directory. Two bare
+    repositories stand in for the aosp and the intellij remote, the working
+    repository points to them by `url.*.insteadOf` rewrites of the real remote
+    urls, which allows the tool to run completely offline.
+    """
+
+    generator = Generator(params)
+
+    aosp = os.path.join(dir, 'aosp.git')
+    intellij = os.path.join(dir, 'intellij.git')
+    repo = os.path.join(dir, 'repo')
+
+    base = params.commits - params.pending - 1
+    first = base - params.picks
+    large = params.commits - params.pending // 2
+
+    history = [('Initial import', generator.initial())]
+    for i in range(1, params.commits):
+        changes = generator.change(
+            i,
+            large=i == large,
+            text_only=i == base + 1,
+        )
+        message = 'Change %d\n\nUpdate %d files.\n\nBug: %d\n' % (
+            i, len(changes), 100000 + i
+        )
+        history.append((message, changes))
+
+    git_init(aosp, bare=True)
+    aosp_hashes = fast_import(aosp, history)
+    git(aosp, 'branch', '-m', 'main', AOSP_BRANCH)
+
+    # the intellij branch starts from a snapshot of the aosp subtree and then
+    # picks the following aosp commits one by one
+    snapshot = {}
+    for _, changes in history[:first + 1]:
+        snapshot.update(changes)
+
+    picks = [('Import from aosp', remap(snapshot))]
+    for i in range(first + 1, base + 1):
+        message, changes = history[i]
+        changes = remap(changes)
+
+        # a bit of drift between the aosp commit and the picked commit
+        if i % 3 == 0:
+            changes['LOCAL_CHANGES.md'] = ['local change %d' % i]
+
+        picks.append(('%s\nAOSP: %s' % (message, aosp_hashes[i]), changes))
+
+    git_init(intellij, bare=True)
+    intellij_hashes = fast_import(intellij, picks)
+    git(intellij, 'branch', '-m', 'main', INTELLIJ_BRANCH)
+
+    git_init(repo, bare=False)
+    git(repo, 'config', 'user.name', 'Benchmark')
+    git(repo, 'config', 'user.email', 'benchmark@localhost')
+    git(repo, 'config', 'url.%s.insteadOf' % aosp, AOSP_REMOTE)
+    git(repo, 'config', 'url.%s.insteadOf' % intellij, INTELLIJ_REMOTE)
+    git(repo, 'remote', 'add', AOSP_ORIGIN, AOSP_REMOTE)
+    git(repo, 'remote', 'add', INTELLIJ_ORIGIN, INTELLIJ_REMOTE)
+    git(repo, 'fetch', '--quiet', AOSP_ORIGIN)
+    git(repo, 'fetch', '--quiet', INTELLIJ_ORIGIN)
+    git(repo, 'checkout', '--quiet', '-b', 'main', intellij_hashes[-1])
+
+    return Fixture(
+        repo=repo,
+        base=aosp_hashes[base],
+        picks=list(zip(intellij_hashes[1:], aosp_hashes[first + 1:base + 1])),
+        next=aosp_hashes[base + 1],
+        large=aosp_hashes[large],
+    )
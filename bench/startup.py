@@ -0,0 +1,119 @@
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# commands that should start fast, they are invoked from scripts
+SIMPLE_COMMANDS = [
+    ['--version'],
+    ['missing', '--help'],
+    ['remap', '--help'],
+    ['reset', '--help'],
+    ['results', '--help'],
+]
+
+# modules that are only required by interactive or patching commands
+HEAVY_MODULES = ['unidiff', 'simple_term_menu']
+
+# budget for the import time of a simple command in seconds, only counts the
+# modules that are not imported by the bare interpreter
+STARTUP_BUDGET = 0.06
+
+# runs the tool
+TOOL = ['-c', 'import aosp; aosp.main()', '--repo', ROOT]
+
+# only starts the interpreter
+BARE = ['-c', 'pass']
+
+
+def import_times(argv: list[str]) -> dict[str, float]:
+    """
+    Runs python with -X importtime and returns the self import time of every
+    imported module in seconds.
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *argv],
+        env=dict(os.environ, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        self, _, name = line.removeprefix('import time:').split('|')
+
+        # skip the header line
+        if not self.strip().isdigit():
+            continue
+
+        times[name.strip()] = int(self) / 1e6
+
+    return times
+
+
+def check(args: list[str], budget: float, repeat: int,
+          bare: set[str]) -> bool:
+    # the minimum over multiple runs is the least noisy estimate
+    runs = [import_times(TOOL + args) for _ in range(repeat)]
+    total = min(
+        sum(time for name, time in it.items() if name not in bare)
+        for it in runs
+    )
+
+    heavy = sorted({
+        name.split('.')[0] for name in runs[0]
+        if name.split('.')[0] in HEAVY_MODULES
+    })
+
+    ok = total <= budget and len(heavy) == 0
+    print('%s aosp %-20s %6.1fms%s' % (
+        'ok' if ok else '!!',
+        ' '.join(args),
+        total * 1000,
+        ' imports %s' % ', '.join(heavy) if heavy else '',
+    ))
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='checks the startup time of simple commands',
+    )
+    parser.add_argument(
+        '--budget',
+        type=float,
+        help='import time budget in milliseconds',
+        default=STARTUP_BUDGET * 1000,
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        help='number of runs per command',
+        default=5,
+    )
+    args = parser.parse_args()
+
+    # the modules of the interpreter startup are not caused by the tool and
+    # their import time varies between machines
+    bare = set(import_times(BARE))
+
+    results = [
+        check(it, args.budget / 1000, args.repeat, bare)
+        for it in SIMPLE_COMMANDS
+    ]
+
+    if not all(results):
+        print('!! startup budget of %.0fms exceeded' % args.budget)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()